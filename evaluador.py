@@ -0,0 +1,143 @@
+"""
+Evaluación vectorizada de planes de manejo (una política por rodal) sin pasar por el solver.
+
+    coefs = coeficientes(rodales, politicas)
+    plan = np.array([...])  # índice de política por rodal, -1 = sin manejo; o (N, R) para N planes
+    resultado = evaluar(plan, coefs, prices)           # sin incendios
+    resultado = evaluar(plan, coefs, prices, bp=bp)    # bp[r][t] o bp[n][r][t], prob. de quema
+
+Lo usan el modelo (tactico.py) para construir sus coeficientes y la post optimización para
+recalcular NPV, v_t y biomasa final de las soluciones.
+"""
+import sys
+
+import numpy as np
+
+if sys.version_info >= (3, 11):
+    import tomllib
+
+    with open("config.toml", "rb") as f:
+        config = tomllib.load(f)
+else:
+    import toml
+
+    config = toml.load("config.toml")
+
+if sys.version_info >= (3, 11):
+    import tomllib
+
+    with open("config_opti.toml", "rb") as f:
+        config_opti = tomllib.load(f)
+else:
+    import toml
+
+    config_opti = toml.load("config_opti.toml")
+
+
+def coeficientes(rodales, politicas, periodos=None):
+    """Tensores de vendible, biomasa y código Kitral por rodal, política y periodo, y las combinaciones
+    (rodal, política) válidas.
+
+    Una combinación es válida si su manejo vende algo en el horizonte; los rodales sin combinaciones
+    válidas quedan con la política 0 (igual que en el modelo original).
+    """
+    periodos = config["horizonte"] if periodos is None else periodos
+    RR = len(rodales)
+    indice = {tuple(politica): j for j, politica in enumerate(politicas)}
+
+    vendible = np.zeros((RR, len(politicas), periodos))
+    biomasa = np.zeros((RR, len(politicas), periodos))
+    kitral_base = np.array([rodales[r]["manejos"][0]["codigo_kitral"][:periodos] for r in range(RR)], dtype=int)
+    kitral = np.repeat(kitral_base[:, None], len(politicas), axis=1)
+    for r in range(RR):
+        for manejo in rodales[r]["manejos"]:
+            j = indice.get((manejo["raleo"], manejo["cosecha"]))
+            if j is not None:
+                vendible[r, j] = manejo["vendible"][:periodos]
+                biomasa[r, j] = manejo["biomass"][:periodos]
+                kitral[r, j] = manejo["codigo_kitral"][:periodos]
+
+    validas = (vendible != 0).any(axis=2)
+    validas[~validas.any(axis=1), 0] = True  # combinaciones base para rodales sin combinaciones
+
+    return {
+        "vendible": vendible,
+        "biomasa": biomasa,
+        "validas": validas,
+        "biomasa_base": np.array([rodales[r]["manejos"][0]["biomass"][:periodos] for r in range(RR)], dtype=float),
+        "kitral": kitral,
+        "kitral_base": kitral_base,
+    }
+
+
+def factores_descuento(prices, tasa=None):
+    """precio_t / (1 + tasa)^t para cada periodo."""
+    tasa = config_opti["opti"]["tasa"] if tasa is None else tasa
+    prices = np.asarray(prices, dtype=float)
+    return prices / (1 + tasa) ** np.arange(len(prices))
+
+
+def asignacion(solucion, n_rodales):
+    """Convierte una solución {(rodal, politica): 1} en el vector de política por rodal (-1 = sin manejo)."""
+    plan = np.full(n_rodales, -1)
+    for r, j in solucion:
+        plan[r] = j
+    return plan
+
+
+def evaluar(plan, coefs, prices, bp=None):
+    """Evalúa uno o varios planes con gathers sobre los tensores de `coeficientes`.
+
+    `plan` es (R,) o (N, R) con el índice de política de cada rodal (-1 = sin manejo). Con `bp`
+    ((R, T) o (N, R, T)) el vendible y la biomasa se multiplican por (1 - bp), como en la post optimización.
+
+    Retorna un diccionario con (N,) o escalares si `plan` es un solo vector:
+        npv: valor presente de las ventas
+        v: (N, T) biomasa vendida por periodo (v_t)
+        biomasa_final: biomasa total al final del horizonte (y de 4.6-4.7)
+        violaciones: cuánto se viola cada restricción (0 si se cumple)
+            presupuesto (4.5), minimo (4.2), suavizado (4.4), biomasa (4.7), invalidas (políticas no válidas)
+        factible: si no viola ninguna
+    """
+    plan = np.asarray(plan)
+    unico = plan.ndim == 1
+    plan = np.atleast_2d(plan)
+    R = plan.shape[1]
+    sin_manejo = plan < 0
+    politica = np.where(sin_manejo, 0, plan)
+    rodal = np.arange(R)
+
+    # Gather (N, R, T): vendible y biomasa de la política de cada rodal, o del caso base si no tiene
+    vendible = np.where(sin_manejo[..., None], 0.0, coefs["vendible"][rodal, politica])
+    final = np.where(sin_manejo, coefs["biomasa_base"][:, -1], coefs["biomasa"][rodal, politica, -1])
+    if bp is not None:
+        bp = np.asarray(bp, dtype=float)
+        vendible = vendible * (1 - bp)
+        final = final * (1 - bp[..., -1])
+
+    v = vendible.sum(axis=1)
+    npv = v @ factores_descuento(prices)
+    biomasa_final = final.sum(axis=1)
+
+    opti = config_opti["opti"]
+    anterior, actual = v[:, :-1], v[:, 1:]
+    violaciones = {
+        "presupuesto": np.maximum(0, opti["C"] * (~sin_manejo).sum(axis=1) - opti["B"]),
+        "minimo": np.maximum(0, opti["D"] - actual).sum(axis=1),
+        "suavizado": np.maximum(0, np.abs(actual - anterior) - anterior / 10).sum(axis=1),
+        "biomasa": np.maximum(0, coefs["biomasa_base"][:, 0].sum() - biomasa_final),
+        "invalidas": (~sin_manejo & ~coefs["validas"][rodal, politica]).sum(axis=1),
+    }
+    # tolerancia relativa para no marcar como infactibles las soluciones del solver
+    factible = np.all([violacion <= 1e-6 * (1 + np.abs(v).max()) for violacion in violaciones.values()], axis=0)
+
+    resultado = {"npv": npv, "v": v, "biomasa_final": biomasa_final, "violaciones": violaciones, "factible": factible}
+    if unico:
+        resultado = {
+            "npv": npv[0],
+            "v": v[0],
+            "biomasa_final": biomasa_final[0],
+            "violaciones": {k: val[0] for k, val in violaciones.items()},
+            "factible": factible[0],
+        }
+    return resultado
@@ -0,0 +1,178 @@
+"""
+Simulador de incendios en NumPy, alternativo a Cell2Fire cuando no hay QGIS ni fire2a (integración
+continua, máquinas sin interfaz) y como referencia de rendimiento.
+
+Autómata celular estocástico sobre la grilla de códigos Kitral: cada incendio parte de una celda
+combustible al azar y en cada paso el frente pasa a cada vecina (8 direcciones) con la probabilidad de
+su código ([simulador.propagacion] de config_opti.toml), aumentada a favor de un viento sorteado por
+simulación. Las celdas de cortafuegos y las sin código no se queman. Todas las simulaciones avanzan a
+la vez como un arreglo (K, alto, ancho).
+
+    cicatrices, padre, paso = simular(combustibles, simulaciones=50, semilla=123)
+    bp = cicatrices.mean(axis=0)                   # probabilidad de quema por celda
+    dpv = valor_protegido(padre, paso, biomasa)    # valor aguas abajo de cada celda
+
+    python incendios_numpy.py    # simulaciones por segundo en un paisaje sintético
+"""
+import sys
+import time
+
+import numpy as np
+
+if sys.version_info >= (3, 11):
+    import tomllib
+
+    with open("config_opti.toml", "rb") as f:
+        config_opti = tomllib.load(f)
+else:
+    import toml
+
+    config_opti = toml.load("config_opti.toml")
+
+# vecinas (dy, dx); la fila -1 es el norte
+VECINOS = [(-1, -1), (-1, 0), (-1, 1), (0, -1), (0, 1), (1, -1), (1, 0), (1, 1)]
+
+
+def tabla_propagacion(combustibles, cortafuegos=None):
+    """Probabilidad de propagación hacia cada celda según su código Kitral (0 si no es combustible)."""
+    combustibles = np.asarray(combustibles)
+    prob = np.zeros(combustibles.shape)
+    for codigo, p in config_opti["simulador"]["propagacion"].items():
+        prob[combustibles == int(codigo)] = p
+    if cortafuegos is not None:
+        prob[np.asarray(cortafuegos) == 1] = 0
+    return prob
+
+
+def factores_viento(rng, simulaciones):
+    """Multiplicador de la propagación por simulación y dirección, (K, 8), con viento sorteado.
+
+    La dirección se sortea alrededor de simulador.viento_direccion y la intensidad entre 0 y
+    simulador.viento_efecto; las diagonales se recorren más lento (distancia raíz de 2).
+    """
+    simulador = config_opti["simulador"]
+    dispersion = simulador["viento_dispersion"] * rng.standard_normal(simulaciones)
+    direccion = np.deg2rad(simulador["viento_direccion"] + dispersion)
+    intensidad = simulador["viento_efecto"] * rng.random(simulaciones)
+    angulos = np.array([np.arctan2(-dy, dx) for dy, dx in VECINOS])
+    distancia = np.array([np.hypot(dy, dx) for dy, dx in VECINOS])
+    return np.exp(intensidad[:, None] * np.cos(angulos[None, :] - direccion[:, None])) / distancia
+
+
+def simular(combustibles, simulaciones=None, semilla=None, cortafuegos=None, igniciones=None, pasos=None):
+    """Simula `simulaciones` incendios a la vez sobre la grilla `combustibles` (alto, ancho).
+
+    `igniciones` es una probabilidad de ignición por celda (uniforme sobre las combustibles si no se da).
+    Si ninguna celda combustible puede encenderse no hay incendios (cicatrices vacías). Retorna, cada uno
+    (K, alto, ancho):
+        cicatrices: celdas quemadas
+        padre: índice plano de la celda desde donde llegó el fuego (-1 para la ignición y no quemadas)
+        paso: paso en que se quemó la celda (0 la ignición, -1 no quemada)
+    """
+    simulador = config_opti["simulador"]
+    simulaciones = simulador["simulaciones"] if simulaciones is None else simulaciones
+    semilla = simulador["semilla"] if semilla is None else semilla
+    pasos = simulador["pasos"] if pasos is None else pasos
+    rng = np.random.default_rng(semilla)
+
+    prob = tabla_propagacion(combustibles, cortafuegos)
+    H, W = prob.shape
+    K = simulaciones
+    viento = factores_viento(rng, K)
+
+    pesos = (prob > 0) * (1.0 if igniciones is None else np.asarray(igniciones, dtype=float))
+    if pesos.sum() == 0:
+        # todo sin combustible, cortafuegos o sin probabilidad de ignición
+        return np.zeros((K, H, W), dtype=bool), np.full((K, H, W), -1), np.full((K, H, W), -1)
+    inicio = rng.choice(H * W, size=K, p=pesos.ravel() / pesos.sum())
+
+    # estado plano por (simulación, celda); solo se recorre el frente de cada paso
+    prob = prob.ravel()
+    cicatrices = np.zeros(K * H * W, dtype=bool)
+    padre = np.full(K * H * W, -1)
+    paso = np.full(K * H * W, -1)
+    frente = np.arange(K) * H * W + inicio
+    cicatrices[frente] = True
+    paso[frente] = 0
+
+    for s in range(1, pasos + 1):
+        if len(frente) == 0:
+            break
+        k, celda = np.divmod(frente, H * W)
+        y, x = np.divmod(celda, W)
+        destinos, origenes = [], []
+        for d, (dy, dx) in enumerate(VECINOS):
+            dentro = (y + dy >= 0) & (y + dy < H) & (x + dx >= 0) & (x + dx < W)
+            kd, destino = k[dentro], (y[dentro] + dy) * W + x[dentro] + dx
+            p = prob[destino] * viento[kd, d]
+            exito = (p > 0) & ~cicatrices[kd * H * W + destino] & (rng.random(len(destino)) < p)
+            destinos.append(kd[exito] * H * W + destino[exito])
+            origenes.append(celda[dentro][exito])
+        # una celda alcanzada desde varias vecinas en el mismo paso se quema una vez
+        frente, primero = np.unique(np.concatenate(destinos), return_index=True)
+        cicatrices[frente] = True
+        padre[frente] = np.concatenate(origenes)[primero]
+        paso[frente] = s
+
+    cicatrices, padre, paso = (a.reshape(K, H, W) for a in (cicatrices, padre, paso))
+    return cicatrices, padre, paso
+
+
+def valor_protegido(padre, paso, valores):
+    """Valor promedio (entre simulaciones) de cada celda y de todas las que se quemaron a partir de ella.
+
+    Es el valor que protege tratar la celda, como la métrica downstream protection value de fire2a (sin
+    escalar): se recorren los pasos hacia atrás sumando el valor de cada celda al de su padre.
+    """
+    K, H, W = paso.shape
+    subarbol = np.where(paso >= 0, np.asarray(valores, dtype=float)[None], 0).ravel()
+    paso = paso.ravel()
+    # celdas quemadas (no igniciones) ordenadas por paso, recorridas en tramos del último al primero
+    quemadas = np.flatnonzero(paso > 0)
+    quemadas = quemadas[np.argsort(paso[quemadas], kind="stable")]
+    cortes = np.searchsorted(paso[quemadas], np.arange(1, paso.max() + 2))
+    destino = quemadas // (H * W) * (H * W) + padre.ravel()[quemadas]
+    for inicio, fin in zip(cortes[-2::-1], cortes[:0:-1]):
+        np.add.at(subarbol, destino[inicio:fin], subarbol[quemadas[inicio:fin]])
+    return subarbol.reshape(K, H * W).mean(axis=0).reshape(H, W)
+
+
+def fraccion_quemada(cicatrices, rid_idx, n_rodales):
+    """Fracción quemada de cada rodal en cada simulación, (K, R), como use_of_QGIS.quema_por_simulacion."""
+    K = len(cicatrices)
+    rid_idx = np.asarray(rid_idx).ravel()
+    validas = rid_idx >= 0
+    celdas = np.bincount(rid_idx[validas], minlength=n_rodales)
+    k, c = np.nonzero(cicatrices.reshape(K, -1)[:, validas])
+    quemas = np.bincount(k * n_rodales + rid_idx[validas][c], minlength=K * n_rodales).reshape(K, n_rodales)
+    return quemas / np.maximum(celdas, 1)
+
+
+def burn_prob_raster(apath, salida, fire_breaks=None, simulaciones=None, semilla=None):
+    """Probabilidad de quema por celda del raster de combustibles `apath`, escrita en `salida` con su grilla."""
+    from fire2a.raster import read_raster, write_raster
+
+    combustibles, info = read_raster(str(apath))
+    cortafuegos = None if fire_breaks is None else read_raster(str(fire_breaks))[0]
+    cicatrices, _, _ = simular(combustibles, simulaciones, semilla, cortafuegos)
+    write_raster(cicatrices.mean(axis=0), str(salida), "GTiff", info["Projection"], info["Transform"])
+    return salida
+
+
+if __name__ == "__main__":
+    # paisaje sintético: manchas de códigos Kitral de pino y eucalipto, con un borde sin combustible
+    rng = np.random.default_rng(0)
+    H, W = 200, 200
+    codigos = np.array([int(c) for c in config_opti["simulador"]["propagacion"]])
+    combustibles = codigos[rng.integers(len(codigos), size=(H // 10, W // 10))].repeat(10, 0).repeat(10, 1)
+    combustibles[:, :5] = -9999
+
+    for K in (10, 50, 200):
+        inicio = time.perf_counter()
+        cicatrices, padre, paso = simular(combustibles, simulaciones=K)
+        dpv = valor_protegido(padre, paso, np.ones((H, W)))
+        tiempo = time.perf_counter() - inicio
+        print(
+            f"{K} simulaciones en {tiempo:.2f} s ({K / tiempo:.1f} sim/s), celdas quemadas medias "
+            f"{cicatrices.sum(axis=(1, 2)).mean():.0f}, dpv máximo {dpv.max():.1f}"
+        )
@@ -0,0 +1,237 @@
+"""
+Optimizador alternativo a tactico.model_t para predios grandes o con poco tiempo: recocido simulado
+sobre planes de manejo (una política por rodal), con varias cadenas independientes en paralelo.
+
+Cada iteración perturba la política de algunos rodales y aplica una búsqueda local que cambia uno o dos
+rodales a la vez, evaluando en bloque el v_t de todos los pares candidatos. El presupuesto (4.5) y la
+validez de las políticas se respetan siempre; mínimos (4.2), suavizado (4.4) y biomasa final (4.7) se
+penalizan en unidades de su holgura. Escribe soluciones_{dataset_name}.csv igual que model_t, solo con
+planes factibles.
+
+    valores_objetivo, soluciones = metaheuristica(rodales, politicas, prices, "rodales_sin_cortafuegos")
+"""
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from evaluador import coeficientes, evaluar, factores_descuento
+from post_optimization import escribir_soluciones
+
+if sys.version_info >= (3, 11):
+    import tomllib
+
+    with open("config_opti.toml", "rb") as f:
+        config_opti = tomllib.load(f)
+else:
+    import toml
+
+    config_opti = toml.load("config_opti.toml")
+
+# violación (en holguras) bajo la que un plan se considera factible
+TOLERANCIA = 1e-9
+
+
+def violacion(v, biomasa_final, biom_0):
+    """Violación de 4.2, 4.4 y 4.7 para v_t (..., T) y biomasa final (...), medida en la holgura de cada
+    restricción: D para 4.2, v_{t-1}/10 (al menos D) para 4.4 y biom_0 para 4.7.
+    """
+    D = config_opti["opti"]["D"]
+    anterior, actual = v[..., :-1], v[..., 1:]
+    return (
+        np.maximum(0, D - actual).sum(axis=-1) / D
+        + (np.maximum(0, np.abs(actual - anterior) - anterior / 10) / np.maximum(anterior / 10, D)).sum(axis=-1)
+        + np.maximum(0, biom_0 - biomasa_final) / biom_0
+    )
+
+
+def plan_codicioso(coefs, prices):
+    """Plan inicial: la política de mayor NPV de cada rodal, en los rodales más rentables que permite el
+    presupuesto (4.5). Suele violar 4.4 y 4.7; la búsqueda local lo repara.
+    """
+    opti = config_opti["opti"]
+    npv = np.where(coefs["validas"], coefs["vendible"] @ factores_descuento(prices), -np.inf)
+    plan = npv.argmax(axis=1)
+    plan[np.argsort(-npv.max(axis=1))[opti["B"] // opti["C"] :]] = -1
+    return plan
+
+
+def movimientos(o, pares, plan, actual, v, biomasa_final, manejados, tensores):
+    """Efecto de cambiar la política de uno (`pares=False`) o dos rodales según las opciones `o`, en
+    bloque y solo con las diferencias respecto del plan: v_t, biomasa final y rodales manejados de cada
+    movimiento, y las opciones (primera, segunda) que lo forman. Un par del mismo rodal equivale a cambiar
+    solo la primera.
+    """
+    vendible, final = tensores["vendible"], tensores["final"]
+    r, j = tensores["rodal"][o], tensores["politica"][o]
+    dv = vendible[r, j] - actual[r]
+    dfinal = final[r, j] - final[r, plan[r]]
+    dman = (j >= 0).astype(int) - (plan[r] >= 0)
+    if not pares:
+        return v + dv, biomasa_final + dfinal, manejados + dman, o, o
+    mismo = r[:, None] == r[None, :]
+    v_mov = v + np.where(mismo[..., None], dv[:, None], dv[:, None] + dv[None])
+    final_mov = biomasa_final + np.where(mismo, dfinal[:, None], dfinal[:, None] + dfinal[None])
+    manejados_mov = manejados + np.where(mismo, dman[:, None], dman[:, None] + dman[None])
+    primera, segunda = np.meshgrid(o, o, indexing="ij")
+    return (
+        v_mov.reshape(-1, v.shape[-1]),
+        final_mov.ravel(),
+        manejados_mov.ravel(),
+        primera.ravel(),
+        segunda.ravel(),
+    )
+
+
+def busqueda_local(plan, tensores, rng):
+    """Descenso por la mejor mejora cambiando la política de uno o dos rodales a la vez: mientras el plan
+    viola 4.2, 4.4 o 4.7 minimiza la violación y luego maximiza el NPV sin perder la factibilidad.
+
+    Los pares se buscan entre metaheuristica.vecindario opciones al azar en cada paso, para acotar la
+    memoria en predios grandes; si la muestra no mejora, se revisa el vecindario completo de un rodal
+    antes de terminar. v_t, biomasa final y manejados se actualizan con la diferencia de cada movimiento.
+    Retorna el plan, su NPV y su violación.
+    """
+    vendible, final, rodal, politica = tensores["vendible"], tensores["final"], tensores["rodal"], tensores["politica"]
+    descuento, biom_0, max_manejados = tensores["descuento"], tensores["biom_0"], tensores["max_manejados"]
+    vecindario = config_opti["metaheuristica"]["vecindario"]
+    R = len(plan)
+    plan = plan.copy()
+    actual = vendible[np.arange(R), plan]
+    v = actual.sum(axis=0)
+    biomasa_final = final[np.arange(R), plan].sum()
+    manejados = int((plan >= 0).sum())
+    npv, viol = v @ descuento, violacion(v, biomasa_final, biom_0)
+
+    while True:
+        # pares de una muestra de opciones y, si no mejoran, todos los cambios de un rodal
+        muestra = rng.permutation(len(rodal))[:vecindario]
+        busquedas = [(muestra, True)]
+        if len(muestra) < len(rodal):
+            busquedas.append((np.arange(len(rodal)), False))
+        for o, pares in busquedas:
+            v_mov, final_mov, manejados_mov, primera, segunda = movimientos(
+                o, pares, plan, actual, v, biomasa_final, manejados, tensores
+            )
+            npv_mov, viol_mov = v_mov @ descuento, violacion(v_mov, final_mov, biom_0)
+
+            # tolerancias para que el redondeo de v_t no haga ciclar la búsqueda
+            permitido = manejados_mov <= max_manejados
+            if viol > TOLERANCIA:
+                clave = np.where(permitido & (viol_mov < viol - TOLERANCIA), viol_mov, np.inf)
+            else:
+                mejora = permitido & (viol_mov <= TOLERANCIA) & (npv_mov > npv + TOLERANCIA * abs(npv))
+                clave = np.where(mejora, -npv_mov, np.inf)
+            if np.isfinite(clave).any():
+                break
+        else:
+            return plan, npv, viol
+
+        k = np.argmin(clave)
+        for opcion in (segunda[k], primera[k]):
+            plan[rodal[opcion]] = politica[opcion]
+            actual[rodal[opcion]] = vendible[rodal[opcion], politica[opcion]]
+        v, biomasa_final, manejados = v_mov[k], final_mov[k], manejados_mov[k]
+        npv, viol = npv_mov[k], viol_mov[k]
+
+
+def recocido(coefs, prices, iteraciones, semilla, plan_inicial=None):
+    """Una cadena de recocido simulado sobre óptimos locales. En cada iteración cambia al azar la política
+    de metaheuristica.perturbacion rodales, aplica busqueda_local y acepta el resultado según el objetivo
+    penalizado npv - peso * violacion, con el peso en NPV medio de una política por unidad de holgura.
+
+    Parte de `plan_inicial` (o plan_codicioso). Retorna el mejor plan: factible si encontró alguno y, entre
+    ellos, el de mayor objetivo penalizado (NPV).
+    """
+    opti, meta = config_opti["opti"], config_opti["metaheuristica"]
+    rng = np.random.default_rng(semilla)
+    validas = coefs["validas"]
+    R = len(validas)
+    # política -1 (sin manejo) como una columna extra al final: vende 0 y deja la biomasa del caso base
+    opciones = np.concatenate([validas, np.ones((R, 1), dtype=bool)], axis=1)
+    rodal, politica = np.nonzero(opciones)
+    tensores = {
+        "vendible": np.concatenate([coefs["vendible"], np.zeros_like(coefs["vendible"][:, :1])], axis=1),
+        "final": np.concatenate([coefs["biomasa"][:, :, -1], coefs["biomasa_base"][:, -1:]], axis=1),
+        "rodal": rodal,
+        "politica": np.where(politica == validas.shape[1], -1, politica),
+        "descuento": factores_descuento(prices),
+        "biom_0": coefs["biomasa_base"][:, 0].sum(),
+        "max_manejados": opti["B"] // opti["C"],
+    }
+    npv_politica = (coefs["vendible"] @ tensores["descuento"])[validas].mean()
+    peso = meta["penalizacion"] * npv_politica
+    temperatura = meta["temperatura"] * npv_politica
+    enfriamiento = 1e-3 ** (1 / max(iteraciones, 1))
+
+    plan = plan_codicioso(coefs, prices) if plan_inicial is None else np.array(plan_inicial)
+    plan, npv, viol = busqueda_local(plan, tensores, rng)
+    objetivo = npv - peso * viol
+    mejor = (viol > TOLERANCIA, -objetivo, plan)
+    for _ in range(iteraciones):
+        candidato = plan.copy()
+        for r in rng.choice(R, min(meta["perturbacion"], R), replace=False):
+            candidato[r] = rng.choice(tensores["politica"][rodal == r])
+        if (candidato >= 0).sum() > tensores["max_manejados"]:
+            continue
+        candidato, npv, viol = busqueda_local(candidato, tensores, rng)
+        delta = (npv - peso * viol) - objetivo
+        if delta >= 0 or rng.random() < np.exp(delta / temperatura):
+            plan, objetivo = candidato, npv - peso * viol
+            if (viol > TOLERANCIA, -objetivo) < mejor[:2]:
+                mejor = (viol > TOLERANCIA, -objetivo, plan)
+        temperatura *= enfriamiento
+
+    return mejor[2]
+
+
+def cadenas_paralelas(coefs, prices, n_cadenas=None, iteraciones=None, semilla=None, procesos=None):
+    """Corre `n_cadenas` cadenas independientes de recocido en un pool de procesos.
+
+    Retorna los planes (N, R) ordenados de mejor a peor (factibles primero, luego por NPV) y su evaluación.
+    """
+    meta = config_opti["metaheuristica"]
+    n_cadenas = meta["cadenas"] if n_cadenas is None else n_cadenas
+    iteraciones = meta["iteraciones"] if iteraciones is None else iteraciones
+    semilla = meta["semilla"] if semilla is None else semilla
+    procesos = (meta["procesos"] or os.cpu_count()) if procesos is None else procesos
+
+    semillas = np.random.SeedSequence(semilla).spawn(n_cadenas)
+    with ProcessPoolExecutor(max_workers=min(procesos, n_cadenas)) as pool:
+        planes = list(
+            pool.map(recocido, [coefs] * n_cadenas, [prices] * n_cadenas, [iteraciones] * n_cadenas, semillas)
+        )
+
+    planes = np.array(planes)
+    resultado = evaluar(planes, coefs, prices)
+    orden = np.lexsort((-resultado["npv"], ~resultado["factible"]))
+    planes = planes[orden]
+    return planes, evaluar(planes, coefs, prices)
+
+
+def metaheuristica(rodales, politicas, prices, dataset_name):
+    """Alternativa a model_t: genera opti.soluciones planes distintos con cadenas de recocido en paralelo
+    y los guarda en soluciones_{dataset_name}.csv. Retorna los valores objetivo y las filas del csv.
+    """
+    coefs = coeficientes(rodales, politicas, len(prices))
+    planes, resultado = cadenas_paralelas(coefs, prices)
+
+    # Quedarse con los mejores planes distintos que sean factibles y mejores que no manejar ningún rodal
+    _, primeros = np.unique(planes, axis=0, return_index=True)
+    primeros = np.sort(primeros)
+    trivial = evaluar(np.full(len(rodales), -1), coefs, prices)
+    utiles = primeros[resultado["factible"][primeros] & (resultado["npv"][primeros] > trivial["npv"])]
+    if len(utiles) == 0:
+        raise ValueError(
+            "metaheuristica: ninguna cadena encontró un plan factible mejor que no manejar; aumente "
+            "metaheuristica.iteraciones o use model_t"
+        )
+    print(f"{len(primeros) - len(utiles)} de {len(primeros)} planes distintos descartados por infactibles")
+    elegidos = utiles[: config_opti["opti"]["soluciones"]]
+    for s in elegidos:
+        print(f"Plan {s}: NPV {resultado['npv'][s]:.2f}")
+
+    soluciones = [{(r, int(j)): 1 for r, j in enumerate(planes[s]) if j >= 0} for s in elegidos]
+    csv_rows = escribir_soluciones(soluciones, [rodal["rid"] for rodal in rodales], politicas, dataset_name)
+    return [float(resultado["npv"][s]) for s in elegidos], csv_rows
@@ -1,8 +1,14 @@
 import ast
+import csv
+import json
+from collections.abc import Mapping
+from pathlib import Path
 import pandas as pd
 import numpy as np
 import sys
 
+from evaluador import factores_descuento
+
 if sys.version_info >= (3, 11):
     import tomllib
 
@@ -27,104 +33,213 @@ else:
 rng = np.random.default_rng(4)
 
 
-def filtro(rodales, csv_soluciones):
-    """filtra los datos de los rodales dependiendo de las distintas soluciones."""
-    # Cargamos los datos de los archivos
-    df_soluciones = pd.read_csv(csv_soluciones)  # Archivo de soluciones
-
-    # Parámetros
-    RR = len(rodales)  # Cantidad de rodales
+def indice_manejos(rodales, politicas):
+    """Tabla (R, P + 1) con la posición en rodales[r]["manejos"] del manejo de cada política.
+
+    La columna j es la política politicas[j] y la última (política -1) el manejo sin raleo ni cosecha,
+    así tabla[r, plan[r]] entrega el manejo de cualquier plan. Las combinaciones sin manejo quedan en -1.
+    """
+    # índice (rid, raleo, cosecha) -> posición del manejo, se construye una sola vez
+    indice = {
+        (rodal["rid"], manejo["raleo"], manejo["cosecha"]): m
+        for rodal in rodales
+        for m, manejo in enumerate(rodal["manejos"])
+    }
+    tabla = np.full((len(rodales), len(politicas) + 1), -1)
+    for r, rodal in enumerate(rodales):
+        tabla[r, :-1] = [indice.get((rodal["rid"], raleo, cosecha), -1) for raleo, cosecha in politicas]
+        tabla[r, -1] = 0
+    return tabla
+
+
+def leer_planes(rodales, csv_soluciones, politicas=None):
+    """Lee un csv de soluciones como matriz (S, R) de índices de política (-1 = sin manejo), en el orden
+    de `rodales`.
+
+    Acepta el formato de escribir_soluciones (columna "rid" e índices en `politicas`) y el formato
+    anterior ("ID Rodal" y celdas "[raleo, cosecha]" o 0); en este cada celda distinta se interpreta
+    una sola vez. En el formato de índices, si junto al csv está su tabla de políticas (ruta_politicas),
+    se usa cuando `politicas` es None y si no se exige que coincida con `politicas`. Retorna los planes y
+    las políticas a las que apuntan los índices.
+    """
+    df_soluciones = pd.read_csv(csv_soluciones)
+    id_col = df_soluciones.columns[0]
+    df_soluciones = df_soluciones.set_index(id_col).reindex([rodal["rid"] for rodal in rodales])
+    if df_soluciones.isna().any(axis=None):
+        raise ValueError(f"{csv_soluciones} no tiene solución para todos los rodales")
+
+    if id_col == "rid":
+        tabla = ruta_politicas(csv_soluciones)
+        if tabla.exists():
+            guardadas = pd.read_csv(tabla).sort_values("politica")[["raleo", "cosecha"]].to_numpy().tolist()
+            if politicas is None:
+                politicas = guardadas
+            elif [[int(raleo), int(cosecha)] for raleo, cosecha in politicas] != guardadas:
+                raise ValueError(f"las políticas no coinciden con las de {tabla}, usadas al escribir {csv_soluciones}")
+        elif politicas is None:
+            raise ValueError("el formato de índices requiere las políticas (print_manejos_possibles)")
+    else:
+        celdas = {celda: ast.literal_eval(str(celda)) for celda in pd.unique(df_soluciones.to_numpy().ravel())}
+        if politicas is None:
+            politicas = sorted({tuple(pol) for pol in celdas.values() if pol != 0})
+        indice = {tuple(pol): j for j, pol in enumerate(politicas)}
+        codigos = {celda: -1 if pol == 0 else indice[tuple(pol)] for celda, pol in celdas.items()}
+        df_soluciones = df_soluciones.apply(lambda col: col.map(codigos))
+
+    return df_soluciones.to_numpy(dtype=int).T, politicas
+
+
+def filtro(rodales, csv_soluciones, politicas=None):
+    """filtra los datos de los rodales dependiendo de las distintas soluciones.
+
+    `politicas` son las de print_manejos_possibles; con el formato de índices de escribir_soluciones se
+    validan contra (o se leen de) la tabla de políticas del csv. Retorna f[soluciones][rodales] con el
+    manejo de cada rodal en cada solución.
+    """
+    planes, politicas = leer_planes(rodales, csv_soluciones, politicas)
+
+    # Gather (S, R) del manejo de cada rodal en cada solución
+    RR = len(rodales)
+    manejos = indice_manejos(rodales, politicas)[np.arange(RR), planes]
+    if (manejos < 0).any():
+        s, r = np.argwhere(manejos < 0)[0]
+        raise ValueError(f"el rodal {rodales[r]['rid']} no tiene manejo para la política de la solución {s + 1}")
 
-    # Lista para almacenar las soluciones
     soluciones = []
-
-    # Iterar sobre cada solución (por columnas, ignorando la primera columna de nombres)
-    for col_idx, col_name in enumerate(df_soluciones.columns[1:]):
-        solucion = {}  # Inicializamos un diccionario por solución
-
-        # Iterar sobre cada rodal
-        for r in range(RR):
-            # Obtener la política
-            pol = ast.literal_eval(df_soluciones[col_name].iloc[r])
-
-            # Inicializamos un diccionario por rodal para almacenar "codigo_kitral" y "vendible"
-            rodal_data = {}
-            rodal_data = {
+    for fila in manejos:
+        solucion = {}
+        for r, m in enumerate(fila):
+            manejo = rodales[r]["manejos"][m]
+            solucion[r] = {
                 "rid": rodales[r]["rid"],
                 "mid": rodales[r]["mid"],
                 "edad_inicial": rodales[r]["edad_inicial"],
+                "codigo_kitral": manejo["codigo_kitral"],
+                "vendible": manejo["vendible"],
+                "biomass": manejo["biomass"],
+                "eventos": manejo["eventos"],
             }
-
-            if pol == 0:
-                # Si no hay raleo ni cosecha, usar el primer manejo
-                rodal_data["codigo_kitral"] = rodales[r]["manejos"][0]["codigo_kitral"]
-                rodal_data["vendible"] = rodales[r]["manejos"][0]["vendible"]
-                rodal_data["biomass"] = rodales[r]["manejos"][0]["biomass"]
-                rodal_data["eventos"] = rodales[r]["manejos"][0]["eventos"]
-            else:
-                # Buscar el manejo que coincida con la política
-                for m in range(len(rodales[r]["manejos"])):
-                    if rodales[r]["manejos"][m]["raleo"] == pol[0] and rodales[r]["manejos"][m]["cosecha"] == pol[1]:
-                        rodal_data["codigo_kitral"] = rodales[r]["manejos"][m]["codigo_kitral"]
-                        rodal_data["vendible"] = rodales[r]["manejos"][m]["vendible"]
-                        rodal_data["biomass"] = rodales[r]["manejos"][m]["biomass"]
-                        rodal_data["eventos"] = rodales[r]["manejos"][m]["eventos"]
-
-            # Guardamos el diccionario de datos del rodal en la solución correspondiente
-            solucion[r] = rodal_data
-
-        # Añadir la solución a la lista de soluciones
         soluciones.append(solucion)
 
     return soluciones
 
 
-def multiplicar_listas(bp, filtro):
-    """multiplica las biomasas vendibles por 1 - prob de quema de cada rodal, periodo y solución."""
-    soluciones = len(bp)  # Número de soluciones (dimensión s)
-    rodales = len(bp[0])  # Número de rodales (dimensión r)
-    periodos = len(bp[0][0])  # Número de periodos (dimensión t)
+def ruta_politicas(csv_soluciones):
+    """Tabla de políticas que acompaña a un csv de soluciones: {nombre}_politicas.csv junto al csv."""
+    csv_soluciones = Path(csv_soluciones)
+    return csv_soluciones.with_name(f"{csv_soluciones.stem}_politicas.csv")
 
-    # Crear una lista vacía para almacenar los resultados de la multiplicación
-    resultado = [[[0 for t in range(periodos)] for r in range(rodales)] for s in range(soluciones)]
 
-    # Iterar sobre soluciones, rodales y periodos
-    biomasa = [0 for _ in range(periodos)]
-    biomasa_cf = [0 for _ in range(periodos)]
+def escribir_soluciones(soluciones, rids, politicas, dataset_name):
+    """Escribe soluciones_{dataset_name}.csv: un rodal (rid) por fila y el índice de su política en
+    `politicas` por columna (-1 si queda sin manejo). `soluciones` son diccionarios {(rodal, politica): 1}.
 
-    for s in range(soluciones):
-        for r in range(rodales):
-            for t in range(periodos):
-                # Multiplicar el valor correspondiente de cada lista
-                resultado[s][r][t] = (1 - bp[s][r][t]) * filtro[s][r]["vendible"][t]
+    Junto al csv queda soluciones_{dataset_name}_politicas.csv con el (raleo, cosecha) de cada índice,
+    para que leer_planes decodifique los índices con las mismas políticas.
+    """
+    # Crear una lista de filas para el CSV, donde cada fila es un rodal y las columnas son las soluciones
+    solutions = [{i: j for i, j in sol.keys()} for sol in soluciones]
+    headers = ["rid"] + [f"Solucion_{s + 1}" for s in range(len(solutions))]
+    csv_rows = [[rid] + [sol.get(i, -1) for sol in solutions] for i, rid in enumerate(rids)]
 
-    return resultado
+    # Guardar en un archivo CSV
+    csv_filename = f"soluciones_{dataset_name}.csv"
+    with open(csv_filename, mode="w", newline="") as file:
+        writer = csv.writer(file)
+        writer.writerow(headers)  # Escribir los encabezados
+        writer.writerows(csv_rows)  # Escribir las filas con los datos
+    with open(ruta_politicas(csv_filename), mode="w", newline="") as file:
+        writer = csv.writer(file)
+        writer.writerow(["politica", "raleo", "cosecha"])
+        writer.writerows([j, int(raleo), int(cosecha)] for j, (raleo, cosecha) in enumerate(politicas))
 
+    print(f"Las soluciones de x[i,j] se han guardado en el archivo {csv_filename} con los IDs de los rodales.")
+    return csv_rows
 
-def sumar_por_solucion(ganancias_totales, prices):
-    """Suma las ganancias totales por solución post incendios."""
-    soluciones = len(ganancias_totales)  # Número de soluciones
-    rodales = len(ganancias_totales[0])  # Número de rodales
-    periodos = len(ganancias_totales[0][0])  # Número de periodos
 
-    # Crear una lista para almacenar los totales por solución
-    total = [0 for _ in range(soluciones)]
-    vt_por_solucion = [[] for _ in range(soluciones)]  # Almacena los valores v_t por solución
+def tensor_filtro(filtro, clave="vendible"):
+    """Tensor (S, R, T) de `clave` ("vendible" o "biomass") de las soluciones de filtro."""
+    return np.array([[rodal[clave] for rodal in solucion.values()] for solucion in filtro], dtype=float)
+
+
+def validar_bp(bp):
+    """bp como arreglo float; lanza ValueError si le falta algún valor (NaN, p. ej. un paisaje sin simular)."""
+    bp = np.asarray(bp, dtype=float)
+    if np.isnan(bp).any():
+        faltantes = np.argwhere(np.isnan(bp))
+        raise ValueError(f"bp no tiene valor en {len(faltantes)} posiciones, por ejemplo {faltantes[:5].tolist()}")
+    return bp
 
-    # Iterar sobre soluciones, rodales y periodos para sumar
-    for s in range(soluciones):
-        suma_solucion = 0  # Inicializamos la suma para cada solución
-        vt = [0 for _ in range(periodos)]  # Valores v_t para la solución actual
-        for t in range(periodos):
-            discount_factor = (1 + config_opti["opti"]["tasa"]) ** t
-            v_t = sum((ganancias_totales[s][r][t] * prices[t]) / discount_factor for r in range(rodales))
-            vt[t] = v_t
-            suma_solucion += v_t
 
-        total[s] = suma_solucion  # Guardamos la suma total para la solución s
-        vt_por_solucion[s] = vt  # Guardamos los valores v_t para la solución s
+def ganancias_esperadas(bp, vendible, prices, tasa=None):
+    """Cosecha esperada, v_t y NPV post incendios a partir de tensores.
 
-    return total, vt_por_solucion
+    `vendible` es (S, R, T) y `bp` (S, R, T) o (K, S, R, T) con K escenarios de quema; los factores
+    precio / (1 + tasa)^t se calculan una sola vez. Lanza ValueError si bp tiene NaN (validar_bp). Retorna:
+        cosecha: (S, R, T) vendible por (1 - bp), promediando los escenarios
+        v: (S, T) o (K, S, T) biomasa vendida por periodo
+        npv: (S,) o (K, S) valor presente de las ventas
+    """
+    bp = validar_bp(bp)
+    vendible = np.asarray(vendible, dtype=float)
+    descuento = factores_descuento(prices[: vendible.shape[-1]], tasa)
+
+    v = np.einsum("...srt,srt->...st", 1 - bp, vendible)
+    npv = v @ descuento
+    cosecha = vendible * (1 - bp.reshape(-1, *vendible.shape).mean(axis=0))
+    return cosecha, v, npv
+
+
+def multiplicar_listas(bp, filtro):
+    """multiplica las biomasas vendibles por 1 - prob de quema de cada rodal, periodo y solución."""
+    cosecha, _, _ = ganancias_esperadas(bp, tensor_filtro(filtro), np.ones(len(bp[0][0])))
+    return cosecha.tolist()
+
+
+def sumar_por_solucion(ganancias_totales, prices):
+    """Suma las ganancias totales por solución post incendios."""
+    ganancias = np.asarray(ganancias_totales, dtype=float)
+    # con bp = 0 la cosecha es la ganancia entregada; el valor por periodo es v_t * precio descontado
+    _, v, total = ganancias_esperadas(np.zeros_like(ganancias), ganancias, prices)
+    vt_por_solucion = v * factores_descuento(prices[: ganancias.shape[-1]])
+    return total.tolist(), vt_por_solucion.tolist()
+
+
+def bootstrap_npv(quemas, vendible, prices, n_bootstrap=None, nivel=None, semilla=None):
+    """Intervalos de confianza del NPV post incendios de cada solución, remuestreando las simulaciones.
+
+    `quemas` (S, T, K, R) es la fracción quemada de cada rodal en cada una de las K simulaciones del paisaje
+    de la solución s en el periodo t. Cada remuestreo elige K simulaciones con reemplazo, las mismas en
+    todos los paisajes (comparten semilla), y su bp es el promedio acumulado en los periodos, como
+    burn_prob_sol. Retorna los NPV (B, S) y los intervalos (S, 2). Lanza ValueError si algún paisaje no
+    se simuló (NaN), en vez de contarlo como sin quemas.
+    """
+    incendios = config_opti["incendios"]
+    n_bootstrap = incendios["bootstrap"] if n_bootstrap is None else n_bootstrap
+    nivel = incendios["nivel"] if nivel is None else nivel
+    rng = np.random.default_rng(incendios["semilla"] if semilla is None else semilla)
+
+    quemas = np.asarray(quemas, dtype=float)
+    sin_simular = np.isnan(quemas).any(axis=(2, 3))
+    if sin_simular.any():
+        raise ValueError(f"paisajes sin simular (solución, periodo): {np.argwhere(sin_simular).tolist()}")
+    K, T = quemas.shape[2], quemas.shape[1]
+    # peso de cada simulación en cada remuestreo (veces que sale / K)
+    pesos = np.zeros((n_bootstrap, K))
+    np.add.at(pesos, (np.arange(n_bootstrap)[:, None], rng.integers(K, size=(n_bootstrap, K))), 1 / K)
+    bp = np.einsum("bk,stkr->bsrt", pesos, quemas)
+    bp = np.cumsum(bp, axis=-1) / np.arange(1, T + 1)
+
+    _, _, npv = ganancias_esperadas(bp, vendible, prices)
+    alfa = (1 - nivel) / 2
+    return npv, np.quantile(npv, [alfa, 1 - alfa], axis=0).T
+
+
+def intervalos_separados(ic):
+    """True si el intervalo de la mejor solución (mayor límite inferior) no se traslapa con ningún otro."""
+    ic = np.asarray(ic)
+    mejor = np.argmax(ic[:, 0])
+    return bool(np.all(np.delete(ic[:, 1], mejor) < ic[mejor, 0]))
 
 
 def graficar_vt_por_solucion(vt_por_solucion, dataset_name):
@@ -168,63 +283,94 @@ def base_case(rodales):
     return base_case_data
 
 
-def biomass_with_fire_breacks(rodales, gdf_cf, id="fid"):
-    import copy
+class VistaEscalada(Mapping):
+    """Vista de solo lectura de un rodal (o manejo) con "biomass" y "vendible" multiplicados por `factor`.
 
-    # Crear una copia profunda para evitar modificar el original
-    rodales2 = copy.deepcopy(rodales)
-    periodos = config["horizonte"]
+    Las demás claves y los arreglos originales se comparten; el escalamiento se hace al leer, así una
+    variante con cortafuegos solo guarda un factor por rodal.
+    """
 
-    for r in range(len(rodales)):
-        prop_rodal_no_cf = gdf_cf.loc[gdf_cf[id] == rodales[r]["rid"], "prop_cf"].values[0]
+    ESCALADAS = ("biomass", "vendible")
 
-        for t in range(periodos):
-            for m in range(len(rodales[r]["manejos"])):
-                rodales2[r]["manejos"][m]["biomass"][t] = rodales[r]["manejos"][m]["biomass"][t] * (
-                    1 - prop_rodal_no_cf
-                )
-                rodales2[r]["manejos"][m]["vendible"][t] = rodales[r]["manejos"][m]["vendible"][t] * (
-                    1 - prop_rodal_no_cf
-                )
+    def __init__(self, datos, factor):
+        self.datos = datos
+        self.factor = factor
 
-    return rodales2
+    def __getitem__(self, clave):
+        valor = self.datos[clave]
+        if clave in self.ESCALADAS:
+            return np.asarray(valor) * self.factor
+        if clave == "manejos":
+            return [VistaEscalada(manejo, self.factor) for manejo in valor]
+        return valor
 
+    def __iter__(self):
+        return iter(self.datos)
 
-def prop_quemada(filtro, filtro_cf, bp, bp_cf, dataset_name):
-    soluciones = len(bp)  # Número de soluciones
-    rodales = len(bp[0])  # Número de rodales
-    periodos = len(bp[0][0])  # Número de periodos
+    def __len__(self):
+        return len(self.datos)
 
-    # Crear listas para almacenar las proporciones de biomasas quemadas por solución y periodo
-    prop_biomasa_quemada = [[0 for _ in range(periodos)] for _ in range(soluciones)]
-    prop_vendible_quemada = [[0 for _ in range(periodos)] for _ in range(soluciones)]
-    prop_biomasa_quemada_cf = [[0 for _ in range(periodos)] for _ in range(soluciones)]
-    prop_vendible_quemada_cf = [[0 for _ in range(periodos)] for _ in range(soluciones)]
 
-    # Iterar sobre soluciones, rodales y periodos para calcular la proporción de biomasa quemada
-    for s in range(soluciones):
-        for t in range(periodos):
-            total_biomass = sum(filtro[s][r]["biomass"][t] for r in range(rodales))
-            total_vendible = sum(filtro[s][r]["vendible"][t] for r in range(rodales))
-            total_biomass_cf = sum(filtro_cf[s][r]["biomass"][t] for r in range(rodales))
-            total_vendible_cf = sum(filtro_cf[s][r]["vendible"][t] for r in range(rodales))
-
-            if total_biomass > 0:
-                prop_biomasa_quemada[s][t] = (
-                    sum((bp[s][r][t] * filtro[s][r]["biomass"][t]) for r in range(rodales)) / total_biomass
-                )
-            if total_vendible > 0:
-                prop_vendible_quemada[s][t] = (
-                    sum((bp[s][r][t] * filtro[s][r]["vendible"][t]) for r in range(rodales)) / total_vendible
-                )
-            if total_biomass_cf > 0:
-                prop_biomasa_quemada_cf[s][t] = (
-                    sum((bp_cf[s][r][t] * filtro_cf[s][r]["biomass"][t]) for r in range(rodales)) / total_biomass_cf
-                )
-            if total_vendible_cf > 0:
-                prop_vendible_quemada_cf[s][t] = (
-                    sum((bp_cf[s][r][t] * filtro_cf[s][r]["vendible"][t]) for r in range(rodales)) / total_vendible_cf
-                )
+def biomass_with_fire_breacks(rodales, gdf_cf, id="fid"):
+    """Rodales con la biomasa y el vendible de cada manejo multiplicados por (1 - prop_cf) del rodal,
+    como vistas sobre `rodales` (no se copian los manejos). Lanza ValueError si algún rodal no tiene prop_cf.
+    """
+    prop_cf = gdf_cf.set_index(id)["prop_cf"].reindex([rodal["rid"] for rodal in rodales])
+    if prop_cf.isna().any():
+        faltantes = prop_cf.index[prop_cf.isna()].tolist()
+        raise ValueError(f"gdf_cf no tiene prop_cf para los rodales {faltantes}")
+    prop_cf = prop_cf.to_numpy(dtype=float)
+    return [VistaEscalada(rodal, 1 - prop) for rodal, prop in zip(rodales, prop_cf)]
+
+
+def cubo_metricas(filtro, bp):
+    """Métricas de pérdidas por incendio de cada solución y periodo, (S, T), en una sola pasada.
+
+    Retorna un diccionario con:
+        biomasa, vendible_total: biomasa y vendible sin incendios
+        biomasa_quemada, vendible_quemada: sum_r bp * biomasa y sum_r bp * vendible
+        vendible: vendible que se alcanza a vender, sum_r (1 - bp) * vendible
+        resto: biomasa - biomasa_quemada - vendible
+        prop_quemada, prop_vendible_quemada, prop_vendible, prop_resto: proporciones (0 si el total es 0)
+    Lanza ValueError si bp tiene NaN (validar_bp).
+    """
+    bp = validar_bp(bp)
+    totales = np.stack([tensor_filtro(filtro, "biomass"), tensor_filtro(filtro, "vendible")])  # (2, S, R, T)
+    biomasa, vendible_total = totales.sum(axis=2)
+    biomasa_quemada, vendible_quemada = np.einsum("ksrt,srt->kst", totales, bp)
+    vendible = vendible_total - vendible_quemada
+    resto = biomasa - biomasa_quemada - vendible
+
+    def proporcion(parte, total):
+        return np.divide(parte, total, out=np.zeros_like(parte), where=total > 0)
+
+    return {
+        "biomasa": biomasa,
+        "vendible_total": vendible_total,
+        "biomasa_quemada": biomasa_quemada,
+        "vendible_quemada": vendible_quemada,
+        "vendible": vendible,
+        "resto": resto,
+        "prop_quemada": proporcion(biomasa_quemada, biomasa),
+        "prop_vendible_quemada": proporcion(vendible_quemada, vendible_total),
+        "prop_vendible": proporcion(vendible, biomasa),
+        "prop_resto": proporcion(resto, biomasa),
+    }
+
+
+def prop_quemada(filtro, filtro_cf, bp, bp_cf, dataset_name, cubo=None, cubo_cf=None):
+    """Proporción de biomasa y de vendible quemada por solución y periodo, sin y con cortafuegos.
+
+    `cubo` y `cubo_cf` (de cubo_metricas) evitan recalcular las sumas si ya se tienen.
+    """
+    cubo = cubo_metricas(filtro, bp) if cubo is None else cubo
+    cubo_cf = cubo_metricas(filtro_cf, bp_cf) if cubo_cf is None else cubo_cf
+    soluciones, periodos = cubo["biomasa"].shape
+
+    prop_biomasa_quemada = cubo["prop_quemada"]
+    prop_vendible_quemada = cubo["prop_vendible_quemada"]
+    prop_biomasa_quemada_cf = cubo_cf["prop_quemada"]
+    prop_vendible_quemada_cf = cubo_cf["prop_vendible_quemada"]
 
     # Graficar la proporción de biomasa quemada por periodo
     import matplotlib.pyplot as plt
@@ -289,32 +435,31 @@ def prop_quemada(filtro, filtro_cf, bp, bp_cf, dataset_name):
     plt.savefig(f"prop_vendible_quemada_por_solucion_{dataset_name}.png")
     plt.show()
 
-    return prop_biomasa_quemada, prop_vendible_quemada, prop_biomasa_quemada_cf, prop_vendible_quemada_cf
-
+    return (
+        prop_biomasa_quemada.tolist(),
+        prop_vendible_quemada.tolist(),
+        prop_biomasa_quemada_cf.tolist(),
+        prop_vendible_quemada_cf.tolist(),
+    )
 
-def biom_quemada(filtro, filtro_cf, bp, bp_cf, dataset_name):
-    soluciones = len(bp)  # Número de soluciones
-    rodales = len(bp[0])  # Número de rodales
-    periodos = len(bp[0][0])  # Número de periodos
 
-    # Crear listas para almacenar las biomasas quemadas por solución y periodo
-    biomasa_quemada = [[0 for _ in range(periodos)] for _ in range(soluciones)]
-    vendible_quemada = [[0 for _ in range(periodos)] for _ in range(soluciones)]
-    biomasa_quemada_cf = [[0 for _ in range(periodos)] for _ in range(soluciones)]
-    vendible_quemada_cf = [[0 for _ in range(periodos)] for _ in range(soluciones)]
+def biom_quemada(filtro, filtro_cf, bp, bp_cf, dataset_name, sol=0, sol_cf=1, cubo=None, cubo_cf=None):
+    """Biomasa y vendible quemados por solución y periodo, sin y con cortafuegos; compara la solución
+    `sol` sin cortafuegos con la `sol_cf` con cortafuegos.
+    """
+    cubo = cubo_metricas(filtro, bp) if cubo is None else cubo
+    cubo_cf = cubo_metricas(filtro_cf, bp_cf) if cubo_cf is None else cubo_cf
+    soluciones, periodos = cubo["biomasa"].shape
 
-    # Iterar sobre soluciones, rodales y periodos para calcular la biomasa quemada
-    for s in range(soluciones):
-        for t in range(periodos):
-            biomasa_quemada[s][t] = sum((bp[s][r][t] * filtro[s][r]["biomass"][t]) for r in range(rodales))
-            biomasa_quemada_cf[s][t] = sum((bp_cf[s][r][t] * filtro_cf[s][r]["biomass"][t]) for r in range(rodales))
-            vendible_quemada[s][t] = sum((bp[s][r][t] * filtro[s][r]["vendible"][t]) for r in range(rodales))
-            vendible_quemada_cf[s][t] = sum((bp_cf[s][r][t] * filtro_cf[s][r]["vendible"][t]) for r in range(rodales))
+    biomasa_quemada = cubo["biomasa_quemada"]
+    vendible_quemada = cubo["vendible_quemada"]
+    biomasa_quemada_cf = cubo_cf["biomasa_quemada"]
+    vendible_quemada_cf = cubo_cf["vendible_quemada"]
 
-    biomasa_total = sum(biomasa_quemada[0][t] for t in range(periodos))
-    vendible_total = sum(vendible_quemada[0][t] for t in range(periodos))
-    biomasa_total_cf = sum(biomasa_quemada_cf[1][t] for t in range(periodos))
-    vendible_total_cf = sum(vendible_quemada_cf[1][t] for t in range(periodos))
+    biomasa_total = biomasa_quemada[sol].sum()
+    vendible_total = vendible_quemada[sol].sum()
+    biomasa_total_cf = biomasa_quemada_cf[sol_cf].sum()
+    vendible_total_cf = vendible_quemada_cf[sol_cf].sum()
 
     # Graficar la biomasa quemada por periodo
     import matplotlib.pyplot as plt
@@ -379,12 +524,18 @@ def biom_quemada(filtro, filtro_cf, bp, bp_cf, dataset_name):
     plt.savefig(f"vendible_quemada_por_solucion_{dataset_name}.png")
     plt.show()
 
-    # Graficar la biomasa por periodo comparando la solución 1 sin cortafuegos y la solución 3 con cortafuegos
+    # Graficar la biomasa por periodo comparando la solución sol sin cortafuegos y la solución sol_cf con cortafuegos
     plt.figure(figsize=(10, 6))
     width = 0.35  # Ancho de las barras
-    plt.bar(periodos_range - width / 2, biomasa_quemada[0], width=width, label="Mejor Solución sin CF", color=colors[0])
     plt.bar(
-        periodos_range + width / 2, biomasa_quemada_cf[1], width=width, label="Mejor Solución con CF", color=colors[1]
+        periodos_range - width / 2, biomasa_quemada[sol], width=width, label="Mejor Solución sin CF", color=colors[0]
+    )
+    plt.bar(
+        periodos_range + width / 2,
+        biomasa_quemada_cf[sol_cf],
+        width=width,
+        label="Mejor Solución con CF",
+        color=colors[1],
     )
 
     # Agregar segunda "leyenda" con valores específicos
@@ -410,13 +561,17 @@ def biom_quemada(filtro, filtro_cf, bp, bp_cf, dataset_name):
     plt.savefig(f"comparacion_biomasa_quemada_{dataset_name}.png")
     plt.show()
 
-    # Graficar la biomasa vendible por periodo comparando la solución 1 sin cortafuegos y la solución 3 con cortafuegos
+    # Graficar la biomasa vendible por periodo comparando la solución sol sin cortafuegos y sol_cf con cortafuegos
     plt.figure(figsize=(10, 6))
     plt.bar(
-        periodos_range - width / 2, vendible_quemada[0], width=width, label="Mejor Solución sin CF", color=colors[0]
+        periodos_range - width / 2, vendible_quemada[sol], width=width, label="Mejor Solución sin CF", color=colors[0]
     )
     plt.bar(
-        periodos_range + width / 2, vendible_quemada_cf[1], width=width, label="Mejor Solución con CF", color=colors[1]
+        periodos_range + width / 2,
+        vendible_quemada_cf[sol_cf],
+        width=width,
+        label="Mejor Solución con CF",
+        color=colors[1],
     )
 
     # Agregar segunda "leyenda" con valores específicos
@@ -442,87 +597,123 @@ def biom_quemada(filtro, filtro_cf, bp, bp_cf, dataset_name):
     plt.savefig(f"comparacion_vendible_quemada_{dataset_name}.png")
     plt.show()
 
-    return biomasa_quemada, vendible_quemada, biomasa_quemada_cf, vendible_quemada_cf
+    return (
+        biomasa_quemada.tolist(),
+        vendible_quemada.tolist(),
+        biomasa_quemada_cf.tolist(),
+        vendible_quemada_cf.tolist(),
+    )
 
 
-def biom_final(filtro, bp):
-    soluciones = len(bp)  # Número de soluciones
-    rodales = len(bp[0])  # Número de rodales
+def biom_final(filtro, bp, cubo=None):
+    """Biomasa al final del horizonte por solución, con y sin incendios."""
+    cubo = cubo_metricas(filtro, bp) if cubo is None else cubo
+    biomass_for_solution = cubo["biomasa"][:, -1] - cubo["biomasa_quemada"][:, -1]
+    biomass_for_solution_no_quema = cubo["biomasa"][:, -1]
+    return biomass_for_solution.tolist(), biomass_for_solution_no_quema.tolist()
+
+
+def guardar_bp(bp, ruta, rids, soluciones=None):
+    """Guarda bp[s][r][t] en el directorio `ruta`: bp.npy (float, NaN donde no hay valor) y coords.json
+    con las coordenadas solucion, rid y periodo de cada eje.
+    """
+    bp = np.array(bp, dtype=float)  # None -> NaN
+    ruta = Path(ruta)
+    ruta.mkdir(parents=True, exist_ok=True)
+    np.save(ruta / "bp.npy", bp)
+    coords = {
+        "solucion": list(range(len(bp))) if soluciones is None else list(soluciones),
+        "rid": [int(rid) if isinstance(rid, (int, np.integer)) else rid for rid in rids],
+        "periodo": list(range(bp.shape[2])),
+    }
+    with open(ruta / "coords.json", "w") as file:
+        json.dump(coords, file)
+    return ruta
+
+
+def cargar_bp(ruta, rids=None, mmap_mode="r"):
+    """Lee un bp guardado con guardar_bp sin cargarlo entero en memoria (memmap de solo lectura).
+
+    Con `rids` se reordenan los rodales para que coincidan con ese orden. Retorna el arreglo (S, R, T),
+    que aceptan directamente las funciones de post optimización, y sus coordenadas.
+    """
+    ruta = Path(ruta)
+    bp = np.load(ruta / "bp.npy", mmap_mode=mmap_mode)
+    with open(ruta / "coords.json") as file:
+        coords = json.load(file)
+    if rids is not None and list(rids) != coords["rid"]:
+        posicion = {rid: r for r, rid in enumerate(coords["rid"])}
+        faltantes = [rid for rid in rids if rid not in posicion]
+        if faltantes:
+            raise ValueError(f"{ruta} no tiene los rodales {faltantes}")
+        bp = bp[:, [posicion[rid] for rid in rids]]
+        coords["rid"] = list(rids)
+    return bp, coords
+
+
+def exportar_series(gdf, filtro, bp, ruta, solucion=0, id="rid"):
+    """Exporta la solución `solucion` por rodal y año para animar en QGIS, sin repetir geometrías.
+
+    Escribe en el GeoPackage `ruta` dos capas: "rodales" con `gdf` (una geometría por polígono) y
+    "series", la tabla larga sin geometría (una fila por polígono y año, con `id`, "ano", "event" y
+    "burn_prob"). "event" es el evento del manejo ese año, o "rodal" si el polígono no está en la solución
+    pero tiene "id". Para la animación temporal, una capa virtual de QGIS une ambas:
+    SELECT s.*, r.geometry FROM series s JOIN rodales r USING ({id}). La tabla se arma con un gather
+    sobre los tensores de eventos y bp. Retorna ambas capas.
+    """
+    import geopandas as gpd
+
+    bp = validar_bp(np.asarray(bp, dtype=float)[solucion])
+    eventos = np.array([rodal["eventos"] for rodal in filtro[solucion].values()], dtype=object)
+    rids = pd.Index([rodal["rid"] for rodal in filtro[solucion].values()])
+    periodos = bp.shape[1]
+    poligonos = gdf.reset_index(drop=True)
+
+    # Gather (polígonos x años): fila del rodal en la solución (-1 si no está) y año de cada fila
+    poligono = np.repeat(np.arange(len(poligonos)), periodos)
+    ano = np.tile(np.arange(periodos), len(poligonos))
+    fila = rids.get_indexer(poligonos[id])[poligono]
+    en_solucion = fila >= 0
+    fuera = np.where(poligonos["id"].notna(), "rodal", None)[poligono]
+    largo = pd.DataFrame(
+        {
+            id: poligonos[id].to_numpy()[poligono],
+            "ano": ano,
+            "event": np.where(en_solucion, eventos[fila, ano], fuera),
+            "burn_prob": np.where(en_solucion, bp[fila, ano], np.nan),
+        }
+    )
 
-    # Crear una lista para almacenar las proporciones por solución y periodo
-    biomass_for_solution = [0 for _ in range(soluciones)]
-    biomass_for_solution_no_quema = [0 for _ in range(soluciones)]
-    # Iterar sobre soluciones, rodales y periodos para calcular la proporción quemada
-    for s in range(soluciones):
-        suma_solucion = sum(((1 - bp[s][r][-1]) * filtro[s][r]["biomass"][-1]) for r in range(rodales))
-        suma_solucion_no_quema = sum((filtro[s][r]["biomass"][-1]) for r in range(rodales))
-        biomass_for_solution[s] = suma_solucion
-        biomass_for_solution_no_quema[s] = suma_solucion_no_quema
-    return biomass_for_solution, biomass_for_solution_no_quema
-
-
-# Tu lista
-# Abre (o crea) un archivo de texto en modo escritura
-"""with open("bp_sin_cortafuegos.txt", "w") as archivo:
-    for item in bp_sin_cortafuegos:
-        archivo.write("%s\n" % item)
-
-
-with open("bp_con_cortafuegos.txt", "w") as archivo:
-    for item in bp_con_cortafuegos:
-        archivo.write("%s\n" % item)"""
-
-
-def grafico_ahora_si(filtro, filtro_cf, bp, bp_cf, dataset_name):
-    rodales = len(bp[0])  # Número de rodales
-    periodos = len(bp[0][0])  # Número de periodos
-    biomasa_quemada = [0 for _ in range(periodos)]
-    vendible_quemada = [0 for _ in range(periodos)]
-    biomasa_quemada_cf = [0 for _ in range(periodos)]
-    vendible_quemada_cf = [0 for _ in range(periodos)]
-    biomasa = [0 for _ in range(periodos)]
-    vendible = [0 for _ in range(periodos)]
-    biomasa_cf = [0 for _ in range(periodos)]
-    vendible_cf = [0 for _ in range(periodos)]
-    resto = [0 for _ in range(periodos)]
-    resto_cf = [0 for _ in range(periodos)]
-    prop_quemada = [0 for _ in range(periodos)]
-    prop_quemada_cf = [0 for _ in range(periodos)]
-    prop_vendible_quemada = [0 for _ in range(periodos)]
-    prop_vendible_quemada_cf = [0 for _ in range(periodos)]
-    prop_vendible = [0 for _ in range(periodos)]
-    prop_vendible_cf = [0 for _ in range(periodos)]
-    prop_resto = [0 for _ in range(periodos)]
-    prop_resto_cf = [0 for _ in range(periodos)]
-
-    for t in range(periodos):
-        biomasa_quemada[t] = sum((bp[0][r][t] * filtro[0][r]["biomass"][t]) for r in range(rodales))
-        vendible_quemada[t] = sum((bp[0][r][t] * filtro[0][r]["vendible"][t]) for r in range(rodales))
-        biomasa_quemada_cf[t] = sum((bp_cf[1][r][t] * filtro_cf[1][r]["biomass"][t]) for r in range(rodales))
-        vendible_quemada_cf[t] = sum((bp_cf[1][r][t] * filtro_cf[1][r]["vendible"][t]) for r in range(rodales))
-        biomasa[t] = sum((filtro[0][r]["biomass"][t]) for r in range(rodales))
-        vendible[t] = sum(((1 - bp[0][r][t]) * filtro[0][r]["vendible"][t]) for r in range(rodales))
-        biomasa_cf[t] = sum((filtro_cf[1][r]["biomass"][t]) for r in range(rodales))
-        vendible_cf[t] = sum(((1 - bp_cf[1][r][t]) * filtro_cf[1][r]["vendible"][t]) for r in range(rodales))
-        resto[t] = biomasa[t] - biomasa_quemada[t] - vendible[t]
-        resto_cf[t] = biomasa_cf[t] - biomasa_quemada_cf[t] - vendible_cf[t]
-        prop_quemada[t] = biomasa_quemada[t] / biomasa[t] if biomasa[t] > 0 else 0
-        prop_quemada_cf[t] = biomasa_quemada_cf[t] / biomasa_cf[t] if biomasa_cf[t] > 0 else 0
-        prop_vendible_quemada[t] = vendible_quemada[t] / (vendible[t] + vendible_quemada[t]) if vendible[t] > 0 else 0
-        prop_vendible_quemada_cf[t] = (
-            vendible_quemada_cf[t] / (vendible_cf[t] + vendible_quemada_cf[t]) if vendible_cf[t] > 0 else 0
-        )
-        prop_vendible[t] = vendible[t] / biomasa[t] if biomasa[t] > 0 else 0
-        prop_vendible_cf[t] = vendible_cf[t] / biomasa_cf[t] if biomasa_cf[t] > 0 else 0
-        prop_resto[t] = resto[t] / biomasa[t] if biomasa[t] > 0 else 0
-        prop_resto_cf[t] = resto_cf[t] / biomasa_cf[t] if biomasa_cf[t] > 0 else 0
-
-    biomasa_quema_total = sum(biomasa_quemada[t] for t in range(periodos))
-    vendible_quema_total = sum(vendible_quemada[t] for t in range(periodos))
-    biomasa_total_quema_cf = sum(biomasa_quemada_cf[t] for t in range(periodos))
-    vendible_total_quema_cf = sum(vendible_quemada_cf[t] for t in range(periodos))
-    vendible_total = sum(vendible[t] for t in range(periodos))
-    vendible_total_cf = sum(vendible_cf[t] for t in range(periodos))
+    poligonos.to_file(ruta, layer="rodales")
+    gpd.GeoDataFrame(largo).to_file(ruta, layer="series")
+    print(f"{len(poligonos)} polígonos y sus series de {periodos} años guardados en {ruta} (capas rodales y series)")
+    return poligonos, largo
+
+
+def grafico_ahora_si(filtro, filtro_cf, bp, bp_cf, dataset_name, sol=0, sol_cf=1, cubo=None, cubo_cf=None):
+    """Compara por periodo la solución `sol` sin cortafuegos con la `sol_cf` con cortafuegos: biomasa
+    quemada, vendida y restante, y sus proporciones.
+    """
+    cubo = cubo_metricas(filtro, bp) if cubo is None else cubo
+    cubo_cf = cubo_metricas(filtro_cf, bp_cf) if cubo_cf is None else cubo_cf
+    periodos = cubo["biomasa"].shape[1]
+    biomasa_quemada, biomasa_quemada_cf = cubo["biomasa_quemada"][sol], cubo_cf["biomasa_quemada"][sol_cf]
+    vendible_quemada, vendible_quemada_cf = cubo["vendible_quemada"][sol], cubo_cf["vendible_quemada"][sol_cf]
+    biomasa, biomasa_cf = cubo["biomasa"][sol], cubo_cf["biomasa"][sol_cf]
+    vendible, vendible_cf = cubo["vendible"][sol], cubo_cf["vendible"][sol_cf]
+    resto, resto_cf = cubo["resto"][sol], cubo_cf["resto"][sol_cf]
+    prop_quemada, prop_quemada_cf = cubo["prop_quemada"][sol], cubo_cf["prop_quemada"][sol_cf]
+    prop_vendible_quemada = cubo["prop_vendible_quemada"][sol]
+    prop_vendible_quemada_cf = cubo_cf["prop_vendible_quemada"][sol_cf]
+    prop_vendible, prop_vendible_cf = cubo["prop_vendible"][sol], cubo_cf["prop_vendible"][sol_cf]
+    prop_resto, prop_resto_cf = cubo["prop_resto"][sol], cubo_cf["prop_resto"][sol_cf]
+
+    biomasa_quema_total = biomasa_quemada.sum()
+    vendible_quema_total = vendible_quemada.sum()
+    biomasa_total_quema_cf = biomasa_quemada_cf.sum()
+    vendible_total_quema_cf = vendible_quemada_cf.sum()
+    vendible_total = vendible.sum()
+    vendible_total_cf = vendible_cf.sum()
 
     # Graficar la biomasa quemada por periodo
     import matplotlib.pyplot as plt
@@ -671,17 +862,20 @@ def grafico_ahora_si(filtro, filtro_cf, bp, bp_cf, dataset_name):
     plt.savefig(f"Proporción_biomasa_resto_{dataset_name}.png")
     plt.show()
 
-    return (
-        biomasa_quemada,
-        vendible_quemada,
-        biomasa_quemada_cf,
-        vendible_quemada_cf,
-        biomasa,
-        vendible,
-        biomasa_cf,
-        vendible_cf,
-        resto,
-        resto_cf,
+    return tuple(
+        valores.tolist()
+        for valores in (
+            biomasa_quemada,
+            vendible_quemada,
+            biomasa_quemada_cf,
+            vendible_quemada_cf,
+            biomasa,
+            vendible,
+            biomasa_cf,
+            vendible_cf,
+            resto,
+            resto_cf,
+        )
     )
 
 
@@ -1,9 +1,10 @@
 # input usuario
 from auxiliary import get_data, create_forest
 from simulator import generate_forest, generate, write, print_manejos_possibles, read_toml
-from tactico import generate_random_walk_prices, model_t
+from tactico import generate_random_walk_prices, model_t, model_t_incendios
 from post_optimization import (
     biomass_with_fire_breacks,
+    cubo_metricas,
     filtro,
     multiplicar_listas,
     sumar_por_solucion,
@@ -11,8 +12,10 @@ from post_optimization import (
     grafico_ahora_si,
     prop_quemada,
     biom_quemada,
+    cargar_bp,
+    exportar_series,
 )
-from use_of_QGIS import fuels_creation, burn_prob_sol
+from use_of_QGIS import fuels_creation, burn_prob_sol, simulador_paisajes
 
 # Bajar del gorwth simulator.py, auxiliary.py y tabla.csv
 
@@ -54,9 +57,18 @@ valores_objetivo, soluciones = model_t(rodales, politicas, prices, "rodales_sin_
 
 valores_objetivo_cf, soluciones_cf = model_t(rodales_cf, politicas, prices, "rodales_con_cortafuegos")
 
+# optimiza el NPV esperado con incendios: alterna optimización y simulación, reutilizando los paisajes ya simulados
+if config_opti["incendios"]["activo"]:
+    simular = simulador_paisajes(
+        [rodal["rid"] for rodal in rodales], id="rid", paisaje="./test/data_modificada/proto_mod.shp"
+    )
+    valor_esperado, soluciones_incendios, bp_incendios = model_t_incendios(
+        rodales, politicas, prices, "rodales_con_incendios", simular
+    )
+
 # filtra los datos de los rodales dependiendo de las soluciones (ojo que las soluciones tienen que tener el mismo orden que los rodales)
-filter = filtro(rodales, "soluciones_rodales_sin_cortafuegos.csv")  # f[soluciones][rodales]
-filtro_cf = filtro(rodales_cf, "soluciones_rodales_con_cortafuegos.csv")
+filter = filtro(rodales, "soluciones_rodales_sin_cortafuegos.csv", politicas)  # f[soluciones][rodales]
+filtro_cf = filtro(rodales_cf, "soluciones_rodales_con_cortafuegos.csv", politicas)
 
 fuels_creation(gdf, filter, "./soluciones/data_modificada", "rid")  # crea los archivos de combustibles
 fuels_creation(gdf_cf, filtro_cf, "./cortafuegos/soluciones/data_modificada", "rid")
@@ -69,6 +81,7 @@ bp_sin_cortafuegos = burn_prob_sol(
     corta_fuegos=False,
     id="rid",
     paisaje="./test/data_modificada/proto_mod.shp",
+    salida="bp_sin_cortafuegos",
 )  # calcula la probabilidad de incendio sin cortafuegos
 bp_con_cortafuegos = burn_prob_sol(
     config_opti["opti"]["soluciones"],
@@ -78,6 +91,7 @@ bp_con_cortafuegos = burn_prob_sol(
     corta_fuegos=True,
     id="rid",
     paisaje="./test/data_modificada/proto_mod.shp",
+    salida="bp_con_cortafuegos",
 )  # calcula la probabilidad de incendio con cortafuegos
 # biomasa vendida post incendios sin cortafuegos
 new_biomass = multiplicar_listas(bp_sin_cortafuegos, filter)  # multiplica la biomasa por la probabilidad de incendio
@@ -96,11 +110,14 @@ graficar_vt_por_solucion(
 graficar_vt_por_solucion(
     vt_con_cortafuegos, "con_conrtafuegos"
 )  # grafica los valores objetivos por solucion con cortafuegos
+# métricas de pérdidas por solución y periodo, calculadas una vez para todos los reportes
+cubo = cubo_metricas(filter, bp_sin_cortafuegos)
+cubo_cf = cubo_metricas(filtro_cf, bp_con_cortafuegos)
 prop_quemada_vendible, prop_quemada_biomass, prop_quemada_vendible_cf, prop_quemada_biomass_cf = prop_quemada(
-    filter, filtro_cf, bp_sin_cortafuegos, bp_con_cortafuegos, "Sin y con cortafuegos"
+    filter, filtro_cf, bp_sin_cortafuegos, bp_con_cortafuegos, "Sin y con cortafuegos", cubo=cubo, cubo_cf=cubo_cf
 )
 biomasa_quemada, vendible_quemada, biomasa_quemada_cf, vendible_quemada_cf = biom_quemada(
-    filter, filtro_cf, bp_sin_cortafuegos, bp_con_cortafuegos, "Sin y con cortafuegos"
+    filter, filtro_cf, bp_sin_cortafuegos, bp_con_cortafuegos, "Sin y con cortafuegos", cubo=cubo, cubo_cf=cubo_cf
 )
 
 print("las ganancias por solucion post simulación de incendios son:")
@@ -134,99 +151,15 @@ for i in range(5):
     print(biomass_for_solution[i] / valores_objetivo[i])
 
 
-import ast  # cambiar por pickle
-
-
-def read_bp_file(filepath):
-    with open(filepath, "r") as file:
-        content = file.read()
-
-    # Convert the string representation of the list back to a Python list
-    bp = ast.literal_eval(content)
-
-    return bp
-
-
-# Example usage
-bp_sin_cortafuegos = read_bp_file("bp_sin_cortafuegos.txt")
-
-# Verifying the structure
-print(len(bp_sin_cortafuegos))  # Should print 5 (number of solutions)
-print(len(bp_sin_cortafuegos[0]))  # Should print 60 (number of rodales)
-print(len(bp_sin_cortafuegos[0][0]))  # Should print 10 (number of periods)
-
-
-bp_con_cortafuegos = read_bp_file("bp_con_cortafuegos.txt")
-# Verifying the structure
-print(len(bp_con_cortafuegos))  # Should print 5 (number of solutions)
-print(len(bp_con_cortafuegos[0]))  # Should print 60 (number of rodales)
-print(len(bp_con_cortafuegos[0][0]))  # Should print 10 (number of periods)
-
-
-import geopandas as gpd
-import numpy as np
-
-# Aquí asumo que tu GeoDataFrame se llama gdf
-# Primer paso: crear la columna "ano" con ceros
-gdf["ano"] = 0
-
-# Segundo paso: crear la columna "event" con la condición "rodal" si "id" no es NaN
-gdf["event"] = np.where(gdf["id"].notna(), "rodal", None)
-
-# Tercer paso: añadir una columna vacía
-gdf["burn_prob"] = None
-
-# Cuarto paso: duplicar el GeoDataFrame y actualizar "ano"
-duplicados = [gdf.copy() for _ in range(10)]
-for i, dup in enumerate(duplicados):
-    dup["ano"] = i
-
-# Combina todos los duplicados en uno solo
-gdf_final = gpd.GeoDataFrame(pd.concat(duplicados, ignore_index=True))
-
-gdf_final
-
-
-for r in range(len(filtro_cf[0])):
-    for t in range(len(filtro_cf[0][0]["vendible"])):
-        gdf_final.loc[(gdf_final["rid"] == filtro_cf[1][r]["rid"]) & (gdf_final["ano"] == t), "event"] = filtro_cf[1][
-            r
-        ]["eventos"][t]
-        gdf_final.loc[(gdf_final["rid"] == filtro_cf[1][r]["rid"]) & (gdf_final["ano"] == t), "burn_prob"] = (
-            bp_con_cortafuegos[1][r][t]
-        )
-gdf_final.to_file("C:\Local\Tesis\datos_grafico_gif_QGIS\cf\datos_grafico_gif_QGIS.shp")
-
-
-import numpy as np
-
-# Aquí asumo que tu GeoDataFrame se llama gdf
-# Primer paso: crear la columna "ano" con ceros
-gdf["ano"] = 0
-
-# Segundo paso: crear la columna "event" con la condición "rodal" si "id" no es NaN
-gdf["event"] = np.where(gdf["id"].notna(), "rodal", None)
-
-# Tercer paso: añadir una columna vacía
-gdf["burn_prob"] = None
-
-# Cuarto paso: duplicar el GeoDataFrame y actualizar "ano"
-duplicados = [gdf.copy() for _ in range(10)]
-for i, dup in enumerate(duplicados):
-    dup["ano"] = i
-
-# Combina todos los duplicados en uno solo
-gdf_final = gpd.GeoDataFrame(pd.concat(duplicados, ignore_index=True))
+# Recargar las probabilidades de quema guardadas por burn_prob_sol, en el orden de los rodales
+rids = [rodal["rid"] for rodal in rodales]
+bp_sin_cortafuegos, coords = cargar_bp("bp_sin_cortafuegos", rids)
+print(bp_sin_cortafuegos.shape)  # (soluciones, rodales, periodos)
 
-gdf_final
+bp_con_cortafuegos, coords_cf = cargar_bp("bp_con_cortafuegos", rids)
+print(bp_con_cortafuegos.shape)  # (soluciones, rodales, periodos)
 
 
-for r in range(len(filter[0])):
-    for t in range(len(filter[0][0]["vendible"])):
-        gdf_final.loc[(gdf_final["rid"] == filter[0][r]["rid"]) & (gdf_final["ano"] == t), "event"] = filter[0][r][
-            "eventos"
-        ][t]
-        gdf_final.loc[(gdf_final["rid"] == filter[0][r]["rid"]) & (gdf_final["ano"] == t), "burn_prob"] = (
-            bp_sin_cortafuegos[0][r][t]
-        )
-gdf_final.to_file("C:\Local\Tesis\datos_grafico_gif_QGIS\scf\datos_grafico_gif_QGIS_sin_cf.shp")
+# series por rodal y año (evento y probabilidad de quema) para animar en QGIS
+exportar_series(gdf, filtro_cf, bp_con_cortafuegos, "datos_grafico_gif_QGIS_cf.gpkg", solucion=1, id="rid")
+exportar_series(gdf, filter, bp_sin_cortafuegos, "datos_grafico_gif_QGIS_sin_cf.gpkg", solucion=0, id="rid")
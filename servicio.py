@@ -0,0 +1,242 @@
+"""
+Servicio local de planificación: mantiene en memoria los rodales, el modelo construido y la última
+probabilidad de quema, y responde consultas "qué pasa si" sin volver a correr runner.py.
+
+    python servicio.py    # http://127.0.0.1:8765, ver [servicio] en config_opti.toml
+
+Consultas (POST con JSON, responde JSON):
+    /evaluar      {"cambios": {"17": [20, 18]}, "precio": 0.9, "incendios": true}
+    /comparar     {"planes": [{"17": [20, 18]}, {"17": 0}], "precio": 1.0, "incendios": false}
+    /reoptimizar  {"fijar": {"17": [20, 18]}, "precio": 0.9, "incendios": true, "aceptar": false}
+    /bp           {"bp": [[...], ...]}    bp[r][t], por ejemplo una solución de burn_prob_sol
+GET /estado retorna la evaluación del plan actual.
+
+`cambios` y `fijar` asignan a rodales (por rid) la política [raleo, cosecha] o 0 (sin manejo) sobre el
+plan actual; `precio` multiplica todos los precios. Las evaluaciones usan evaluador.evaluar y las
+re-optimizaciones cambian cotas y coeficientes del modelo en el lugar, partiendo del plan actual.
+"""
+import json
+import sys
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+import numpy as np
+from gurobipy import GRB, GurobiError
+
+from evaluador import asignacion, coeficientes, evaluar
+from tactico import construir_modelo, generate_random_walk_prices
+
+if sys.version_info >= (3, 11):
+    import tomllib
+
+    with open("config_opti.toml", "rb") as f:
+        config_opti = tomllib.load(f)
+else:
+    import toml
+
+    config_opti = toml.load("config_opti.toml")
+
+
+def crear_estado(rodales, politicas, prices, bp=None):
+    """Construye el modelo, lo resuelve una vez y retorna el estado que usan las consultas."""
+    modelo = construir_modelo(rodales, politicas, prices)
+    if modelo["n_clase"].max() > 1:
+        raise ValueError("el servicio requiere el modelo por rodal (formulacion.clases = false)")
+    model, x = modelo["model"], modelo["x"]
+    model.setParam("TimeLimit", config_opti["servicio"]["tiempo_limite"] or GRB.INFINITY)
+    model.optimize()
+
+    RR = len(rodales)
+    estado = {
+        "modelo": modelo,
+        "coefs": coeficientes(rodales, politicas, len(modelo["H"])),
+        "politicas": politicas,
+        "rids": [rodal["rid"] for rodal in rodales],
+        "indice_rid": {str(rodal["rid"]): r for r, rodal in enumerate(rodales)},
+        "indice_politica": {tuple(politica): j for j, politica in enumerate(politicas)},
+        "prices": np.asarray(prices[: len(modelo["H"])], dtype=float),
+        "bp": np.zeros((RR, len(modelo["H"]))) if bp is None else np.asarray(bp, dtype=float),
+        "plan": asignacion([k for k in modelo["valid_combinations"] if x[k].X > 0.5], RR),
+    }
+    return estado
+
+
+def aplicar_cambios(estado, cambios):
+    """Copia del plan actual con las políticas de `cambios` ({rid: [raleo, cosecha] o 0})."""
+    plan = estado["plan"].copy()
+    for rid, politica in (cambios or {}).items():
+        if str(rid) not in estado["indice_rid"]:
+            raise ValueError(f"rodal {rid} no existe")
+        r = estado["indice_rid"][str(rid)]
+        if politica == 0:
+            plan[r] = -1
+            continue
+        j = estado["indice_politica"].get(tuple(politica))
+        if j is None or not estado["coefs"]["validas"][r, j]:
+            raise ValueError(f"la política {politica} no es válida para el rodal {rid}")
+        plan[r] = j
+    return plan
+
+
+def describir(estado, plan, resultado):
+    """Resultado de evaluar como diccionario serializable, con la política de cada rodal del plan."""
+    return {
+        "npv": float(resultado["npv"]),
+        "v": [float(val) for val in resultado["v"]],
+        "biomasa_final": float(resultado["biomasa_final"]),
+        "factible": bool(resultado["factible"]),
+        "violaciones": {k: float(val) for k, val in resultado["violaciones"].items()},
+        "plan": {
+            str(rid): list(estado["politicas"][j]) if j >= 0 else 0 for rid, j in zip(estado["rids"], plan.tolist())
+        },
+    }
+
+
+def fila_resultado(resultado, n):
+    """Resultado del plan n cuando evaluar recibió varios planes."""
+    return {
+        k: {c: val[n] for c, val in valor.items()} if isinstance(valor, dict) else valor[n]
+        for k, valor in resultado.items()
+    }
+
+
+def consultar_evaluar(estado, consulta):
+    """Evalúa el plan actual con `cambios`; incluye la diferencia de NPV respecto del plan actual."""
+    prices = estado["prices"] * consulta.get("precio", 1.0)
+    bp = estado["bp"] if consulta.get("incendios", False) else None
+    planes = np.stack([estado["plan"], aplicar_cambios(estado, consulta.get("cambios"))])
+    resultado = evaluar(planes, estado["coefs"], prices, bp=bp)
+    respuesta = describir(estado, planes[1], fila_resultado(resultado, 1))
+    respuesta["diferencia"] = float(resultado["npv"][1] - resultado["npv"][0])
+    return respuesta
+
+
+def consultar_comparar(estado, consulta):
+    """Evalúa varios planes (cambios sobre el plan actual) en una sola llamada; el primero es el actual."""
+    prices = estado["prices"] * consulta.get("precio", 1.0)
+    bp = estado["bp"] if consulta.get("incendios", False) else None
+    planes = np.stack([estado["plan"]] + [aplicar_cambios(estado, cambios) for cambios in consulta.get("planes", [])])
+    resultado = evaluar(planes, estado["coefs"], prices, bp=bp)
+    comparacion = []
+    for n, plan in enumerate(planes):
+        fila = describir(estado, plan, fila_resultado(resultado, n))
+        del fila["plan"]
+        comparacion.append(fila)
+    return {"planes": comparacion}
+
+
+def consultar_reoptimizar(estado, consulta):
+    """Re-optimiza con precios escalados, NPV esperado (`incendios`) y rodales fijos, partiendo del plan actual.
+
+    Las políticas fijadas se deshacen al terminar; con `aceptar` el nuevo plan y los precios quedan como
+    estado actual.
+    """
+    modelo = estado["modelo"]
+    model, x = modelo["model"], modelo["x"]
+    combinaciones = modelo["valid_combinations"]
+    factor = consulta.get("precio", 1.0)
+    fijar = aplicar_cambios(estado, consulta.get("fijar"))
+    fijados = {estado["indice_rid"][str(rid)] for rid in consulta.get("fijar", {})}
+    for r in fijados:
+        if fijar[r] >= 0 and (r, fijar[r]) not in x:
+            raise ValueError(f"la política de rodal {estado['rids'][r]} fue eliminada por el presolve del modelo")
+
+    # Coeficientes del objetivo: NPV (esperado si se pide) con los precios escalados
+    perdida = estado["bp"] if consulta.get("incendios", False) else np.zeros_like(estado["bp"])
+    descuento = modelo["descuento"] * factor
+    obj = (modelo["vendible"] * (1 - perdida)[:, None, :]) @ descuento
+    variables = [x[k] for k in combinaciones]
+    model.setAttr("Obj", variables, [float(obj[k]) for k in combinaciones])
+    model.setAttr("UB", variables, [0.0 if k[0] in fijados and fijar[k[0]] != k[1] else 1.0 for k in combinaciones])
+    model.setAttr("LB", variables, [1.0 if k[0] in fijados and fijar[k[0]] == k[1] else 0.0 for k in combinaciones])
+    model.setAttr("Start", variables, [1.0 if estado["plan"][i] == j else 0.0 for i, j in combinaciones])
+    model.optimize()
+
+    respuesta = {"estado_gurobi": model.Status, "factible": False}
+    if model.SolCount > 0:
+        plan = asignacion([k for k in combinaciones if x[k].X > 0.5], len(estado["plan"]))
+        bp = estado["bp"] if consulta.get("incendios", False) else None
+        respuesta = describir(estado, plan, evaluar(plan, estado["coefs"], estado["prices"] * factor, bp=bp))
+        respuesta["gap"] = model.MIPGap * 100
+        respuesta["cambios"] = int((plan != estado["plan"]).sum())
+        if consulta.get("aceptar", False):
+            estado["plan"] = plan
+            estado["prices"] = estado["prices"] * factor
+            modelo["descuento"] = descuento
+
+    # Deshacer las fijaciones; el objetivo vuelve al NPV con los precios actuales
+    model.setAttr("UB", variables, [1.0] * len(variables))
+    model.setAttr("LB", variables, [0.0] * len(variables))
+    model.setAttr("Obj", variables, [float(modelo["vendible"][k] @ modelo["descuento"]) for k in combinaciones])
+    return respuesta
+
+
+def consultar_bp(estado, consulta):
+    """Reemplaza la probabilidad de quema que usan las consultas con `incendios`."""
+    bp = np.asarray(consulta["bp"], dtype=float)
+    if bp.shape != estado["bp"].shape:
+        raise ValueError(f"bp debe tener forma {estado['bp'].shape}, no {bp.shape}")
+    estado["bp"] = np.nan_to_num(bp)
+    return {"bp": list(bp.shape)}
+
+
+RUTAS = {
+    "/evaluar": consultar_evaluar,
+    "/comparar": consultar_comparar,
+    "/reoptimizar": consultar_reoptimizar,
+    "/bp": consultar_bp,
+}
+
+
+def servir(estado, host=None, puerto=None):
+    """Atiende consultas HTTP en `host:puerto` hasta Ctrl+C, una a la vez (el modelo no es compartible)."""
+    host = config_opti["servicio"]["host"] if host is None else host
+    puerto = config_opti["servicio"]["puerto"] if puerto is None else puerto
+
+    class Manejador(BaseHTTPRequestHandler):
+        def responder(self, codigo, cuerpo):
+            datos = json.dumps(cuerpo).encode()
+            self.send_response(codigo)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(datos)))
+            self.end_headers()
+            self.wfile.write(datos)
+
+        def do_GET(self):
+            if self.path != "/estado":
+                return self.responder(404, {"error": f"ruta {self.path} no existe"})
+            self.responder(200, consultar_evaluar(estado, {}))
+
+        def do_POST(self):
+            if self.path not in RUTAS:
+                return self.responder(404, {"error": f"ruta {self.path} no existe"})
+            inicio = time.perf_counter()
+            try:
+                consulta = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+                respuesta = RUTAS[self.path](estado, consulta)
+            except (KeyError, TypeError, ValueError) as error:
+                return self.responder(400, {"error": str(error)})
+            except GurobiError as error:
+                # falla del solver (licencia, memoria, modelo): la consulta era válida
+                return self.responder(500, {"error": f"Gurobi: {error}"})
+            respuesta["tiempo"] = time.perf_counter() - inicio
+            self.responder(200, respuesta)
+
+    servidor = HTTPServer((host, puerto), Manejador)
+    print(f"Servicio de planificación en http://{host}:{puerto}")
+    try:
+        servidor.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        servidor.server_close()
+
+
+if __name__ == "__main__":
+    from simulator import generate, generate_forest, print_manejos_possibles, read_toml
+
+    config = read_toml("config.toml")
+    rodales = generate(rodales=generate_forest())
+    politicas = print_manejos_possibles(config)
+    prices = generate_random_walk_prices(config_opti["opti"]["Price"], config["horizonte"], mu=0.05, sigma=0.1)
+    servir(crear_estado(rodales, politicas, prices))
@@ -4,6 +4,12 @@ import matplotlib.pyplot as plt
 import numpy as np
 import sys
 import csv
+import json
+import time
+from pathlib import Path
+
+from evaluador import asignacion, coeficientes, evaluar, factores_descuento
+from post_optimization import escribir_soluciones
 
 
 if sys.version_info >= (3, 11):
@@ -63,46 +69,183 @@ def no_poli(rodales):
     return no_pol
 
 
-def model_t(rodales, politicas, prices, dataset_name):
-    """Modelo de optimización para maximizar el valor presente neto (NPV) de la venta de biomasa."""
+def callback_telemetria(intervalo=None):
+    """Crea un callback que muestrea cota, incumbente, gap, nodos y tiempo cada `intervalo` segundos.
+
+    Los eventos MIP se descartan hasta que pase el intervalo (solo se consulta RUNTIME), los MIPSOL
+    (nuevo incumbente) se registran siempre. Retorna el callback y la lista donde se acumula la traza.
+    """
+    intervalo = config_opti["telemetria"]["intervalo"] if intervalo is None else intervalo
+    traza = []
+    ultima_muestra = [-float("inf")]  # tiempo de la última muestra MIP
+
+    def muestra(tiempo, cota, incumbente, nodos, evento):
+        # Evita divisiones por cero y el incumbente "infinito" antes de la primera solución
+        gap = abs((cota - incumbente) / incumbente) * 100 if 0 < abs(incumbente) < GRB.INFINITY else None
+        traza.append(
+            {"tiempo": tiempo, "cota": cota, "incumbente": incumbente, "gap": gap, "nodos": nodos, "evento": evento}
+        )
+
+    def callback(model, where):
+        if where == GRB.Callback.MIP:
+            tiempo = model.cbGet(GRB.Callback.RUNTIME)
+            if tiempo - ultima_muestra[0] < intervalo:
+                return
+            ultima_muestra[0] = tiempo
+            muestra(
+                tiempo,
+                model.cbGet(GRB.Callback.MIP_OBJBND),
+                model.cbGet(GRB.Callback.MIP_OBJBST),
+                model.cbGet(GRB.Callback.MIP_NODCNT),
+                "mip",
+            )
+        elif where == GRB.Callback.MIPSOL:
+            muestra(
+                model.cbGet(GRB.Callback.RUNTIME),
+                model.cbGet(GRB.Callback.MIPSOL_OBJBND),
+                model.cbGet(GRB.Callback.MIPSOL_OBJ),
+                model.cbGet(GRB.Callback.MIPSOL_NODCNT),
+                "sol",
+            )
+
+    return callback, traza
+
+
+def cerrar_traza(model, traza):
+    """Agrega a la traza el estado final del modelo luego de optimizar."""
+    if model.SolCount > 0:
+        traza.append(
+            {
+                "tiempo": model.Runtime,
+                "cota": model.ObjBound,
+                "incumbente": model.ObjVal,
+                "gap": model.MIPGap * 100,
+                "nodos": model.NodeCount,
+                "evento": "fin",
+            }
+        )
+    return traza
+
+
+def escribir_traza(traza, ruta):
+    """Escribe una traza de telemetría en csv o jsonl según la extensión de `ruta`."""
+    ruta = Path(ruta)
+    ruta.parent.mkdir(parents=True, exist_ok=True)
+    campos = ["tiempo", "cota", "incumbente", "gap", "nodos", "evento"]
+    with open(ruta, mode="w", newline="") as file:
+        if ruta.suffix == ".jsonl":
+            for fila in traza:
+                file.write(json.dumps(fila) + "\n")
+        else:
+            writer = csv.DictWriter(file, fieldnames=campos)
+            writer.writeheader()
+            writer.writerows(traza)
+    return ruta
+
+
+def leer_traza(ruta):
+    """Lee una traza escrita por `escribir_traza` y la retorna como diccionario de arreglos por campo."""
+    ruta = Path(ruta)
+    with open(ruta, newline="") as file:
+        if ruta.suffix == ".jsonl":
+            filas = [json.loads(linea) for linea in file if linea.strip()]
+        else:
+            filas = list(csv.DictReader(file))
+    traza = {}
+    for campo in ["tiempo", "cota", "incumbente", "gap", "nodos"]:
+        traza[campo] = np.array([np.nan if f[campo] in (None, "") else float(f[campo]) for f in filas])
+    traza["evento"] = np.array([f["evento"] for f in filas])
+    return traza
+
+
+def podar_politicas(coefs, duplicados=True, dominados=True):
+    """Elimina de `coefs["validas"]` las combinaciones (rodal, política) duplicadas o dominadas.
+
+    Todas las políticas cuestan lo mismo (C), así que dentro de un rodal la política j está dominada
+    por k si k vende al menos lo mismo en cada periodo y deja al menos la misma biomasa final, siendo
+    estrictamente mejor en algo. Entre duplicados exactos (mismo vendible, biomasa final y códigos
+    Kitral, que cambian el paisaje de incendios) se conserva el de menor índice.
+    Ojo: con el suavizado 4.4 (cotas a ambos lados de v_t) podar dominadas no garantiza el mismo óptimo.
+
+    Retorna cuántas combinaciones se eliminaron por cada criterio.
+    """
+    a, validas, kitral = coefs["vendible"], coefs["validas"], coefs["kitral"]
+    b = coefs["biomasa"][:, :, -1]
+    podadas = {"duplicados": 0, "dominados": 0}
+
+    for r in range(len(validas)):
+        cols = np.flatnonzero(validas[r])
+        if len(cols) < 2:
+            continue
+        A, bb = a[r, cols], b[r, cols]
+        # ge[k, j]: k vende y deja al menos lo mismo que j
+        ge = (A[:, None, :] >= A[None, :, :]).all(axis=2) & (bb[:, None] >= bb[None, :])
+        iguales = ge & ge.T
+        mismo_kitral = (kitral[r, cols][:, None, :] == kitral[r, cols][None, :, :]).all(axis=2)
+        quitar = np.zeros(len(cols), dtype=bool)
+        if duplicados:
+            duplicada = np.triu(iguales & mismo_kitral, 1).any(axis=0)
+            podadas["duplicados"] += int(duplicada.sum())
+            quitar |= duplicada
+        if dominados:
+            dominada = (ge & ~iguales).any(axis=0) & ~quitar
+            podadas["dominados"] += int(dominada.sum())
+            quitar |= dominada
+        validas[r, cols[quitar]] = False
+
+    return podadas
+
+
+def construir_modelo(rodales, politicas, prices):
+    """Construye el modelo de optimización (sin restricciones de diversidad).
+
+    Retorna un diccionario con el modelo de Gurobi, sus variables, los coeficientes usados y las
+    restricciones cuyos coeficientes cambian al re-optimizar (4.3 y 4.4 por periodo, 4.6 por rodal).
+    """
     # Configuraciones y parámetros iniciales
     tasa = config_opti["opti"]["tasa"]
     biom_0 = calc_biomass_0(rodales)
-    no_pol = no_poli(rodales)
-
-    RR = len(rodales)
     periodos = config["horizonte"]
 
-    a = [[[0 for _ in range(periodos)] for _ in range(len(politicas))] for _ in range(RR)]
-    b = [[0 for _ in range(len(politicas))] for _ in range(RR)]
-    rodales_sin_combinaciones = set(range(RR))
-    valid_combinations = set()
-
-    # Asignar combinaciones válidas iniciales
-    for r in range(RR):
-        for m in range(len(rodales[r]["manejos"])):
-            r_value = rodales[r]["manejos"][m]["raleo"]
-            c_value = rodales[r]["manejos"][m]["cosecha"]
-            if [r_value, c_value] in politicas:
-                politica = politicas.index([r_value, c_value])
-                for t in range(periodos):
-                    a[r][politica][t] = rodales[r]["manejos"][m]["vendible"][t]
-                    b[r][politica] = rodales[r]["manejos"][m]["biomass"][-1]
-                    if any(a[r][politica][t] != 0 for t in range(periodos)):
-                        valid_combinations.add((r, politica))
-                        rodales_sin_combinaciones.discard(r)
-
-    # Agregar combinaciones base para rodales sin combinaciones
-    for rodal in rodales_sin_combinaciones:
-        valid_combinations.add((rodal, 0))
+    coefs = coeficientes(rodales, politicas, periodos)
+    presolve = config_opti["presolve"]
+    if presolve["duplicados"] or presolve["dominados"]:
+        total = int(coefs["validas"].sum())
+        podadas = podar_politicas(coefs, presolve["duplicados"], presolve["dominados"])
+        print(
+            f"Presolve: {podadas['duplicados']} combinaciones duplicadas y {podadas['dominados']} dominadas "
+            f"eliminadas de {total}"
+        )
+    a = coefs["vendible"]
+    b = coefs["biomasa"][:, :, -1]
+    no_pol = coefs["biomasa_base"][:, -1]
+    validas = coefs["validas"]
+
+    # Clases de rodales: con la opción de clases, los rodales con columnas idénticas se agrupan y x[k, j]
+    # cuenta cuántos rodales de la clase k toman la política j; si no, cada rodal es su propia clase
+    RR = len(rodales)
+    if config_opti["formulacion"]["clases"]:
+        clave = np.concatenate([a.reshape(RR, -1), b, validas, no_pol[:, None]], axis=1)
+        _, representante, clase, n_clase = np.unique(
+            clave, axis=0, return_index=True, return_inverse=True, return_counts=True
+        )
+        clase = clase.ravel()
+        a, b, no_pol, validas = a[representante], b[representante], no_pol[representante], validas[representante]
+        print(f"Clases: {RR} rodales agrupados en {len(n_clase)} clases")
+    else:
+        clase, n_clase = np.arange(RR), np.ones(RR, dtype=int)
+    orden = np.argsort(clase, kind="stable")
+    miembros = np.split(orden, np.cumsum(n_clase)[:-1])  # rodales de cada clase, en orden de índice
+
+    valid_combinations = gp.tuplelist((int(k), int(j)) for k, j in zip(*np.nonzero(validas)))
+    descuento = factores_descuento(prices[:periodos], tasa)
 
     # Parámetros del modelo
     B = config_opti["opti"]["B"]
     C = config_opti["opti"]["C"]
     D = config_opti["opti"]["D"]
 
-    R = list(range(RR))
-    M = list(range(len(politicas)))
+    R = list(range(len(n_clase)))  # clases (rodales si no se agrupan)
     H = list(range(periodos))
 
     # Crear el modelo de optimización
@@ -115,16 +258,21 @@ def model_t(rodales, politicas, prices, dataset_name):
     # model.setParam("PumpPasses", 10)
 
     # Variables
-    x = model.addVars(valid_combinations, vtype=GRB.BINARY)
-    v = model.addVars(H, vtype=GRB.CONTINUOUS)
-    y = model.addVars(R, vtype=GRB.CONTINUOUS)
-
-    print(f"Cantidad de variables binarias x: {len(valid_combinations)}")
+    if n_clase.max() > 1:
+        x = model.addVars(
+            valid_combinations, vtype=GRB.INTEGER, ub=[int(n_clase[k]) for k, _ in valid_combinations], name="x"
+        )
+    else:
+        x = model.addVars(valid_combinations, vtype=GRB.BINARY, name="x")
+    v = model.addVars(H, vtype=GRB.CONTINUOUS, name="v")
+    y = model.addVars(R, vtype=GRB.CONTINUOUS, name="y")
+
+    print(f"Cantidad de variables {'enteras' if n_clase.max() > 1 else 'binarias'} x: {len(valid_combinations)}")
     print(f"Cantidad de variables continuas v: {len(H)}")
     print(f"Cantidad de variables continuas y: {len(R)}")
 
     # Función objetivo
-    npv = gp.quicksum(x[i, j] * prices[t] * a[i][j][t] / (1 + tasa) ** t for (i, j) in valid_combinations for t in H)
+    npv = gp.quicksum(x[i, j] * float(a[i, j] @ descuento) for (i, j) in valid_combinations)
     model.setObjective(npv, GRB.MAXIMIZE)
 
     # Restricciones
@@ -132,97 +280,353 @@ def model_t(rodales, politicas, prices, dataset_name):
     model.addConstr(gp.quicksum(x[i, j] * C for (i, j) in valid_combinations) <= B)
     # 4.1
     for i in R:
-        model.addConstr(gp.quicksum(x[i, j] for (i_, j) in valid_combinations if i_ == i) <= 1)
+        model.addConstr(x.sum(i, "*") <= n_clase[i])
     # 4.3
+    restr_v = {}
+    restr_suave = {}
     for t in H:
-        model.addConstr(gp.quicksum(x[i, j] * a[i][j][t] for (i, j) in valid_combinations) == v[t])
+        restr_v[t] = model.addConstr(gp.quicksum(x[i, j] * a[i, j, t] for (i, j) in valid_combinations) - v[t] == 0)
         if t >= 1:
             # 4.4
-            model.addConstr(-v[t - 1] + v[t] <= v[t - 1] / 10)
-            model.addConstr(-v[t - 1] + v[t] >= -v[t - 1] / 10)
+            restr_suave[t] = (
+                model.addConstr(-v[t - 1] + v[t] <= v[t - 1] / 10),
+                model.addConstr(-v[t - 1] + v[t] >= -v[t - 1] / 10),
+            )
             # 4.2
             model.addConstr(v[t] >= D)
 
+    # 4.6: y_i = sum_j b_ij x_ij + (n_i - sum_j x_ij) no_pol_i, con n_i = 1 si no se agrupan
+    restr_y = {}
     for i in R:
-        y_expr = gp.quicksum(b[i][j] * x[i, j] for (i_, j) in valid_combinations if i_ == i)
-        policy_selected = gp.quicksum(x[i, j] for (i_, j) in valid_combinations if i_ == i)
-        # 4.6
-        model.addConstr(y[i] == y_expr + (1 - policy_selected) * no_pol[i])
+        restr_y[i] = model.addConstr(
+            y[i] + gp.quicksum((no_pol[i] - b[i, j]) * x[i, j] for (_, j) in valid_combinations.select(i, "*"))
+            == n_clase[i] * no_pol[i]
+        )
     # 4.7
-    model.addConstr(gp.quicksum(y[i] for i in R) >= biom_0)
-
-    # Registro del progreso del objetivo y gap
-    all_obj_vals = []
-    all_gaps = []
+    restr_biom = model.addConstr(gp.quicksum(y[i] for i in R) >= biom_0)
+
+    return {
+        "model": model,
+        "x": x,
+        "v": v,
+        "y": y,
+        "valid_combinations": valid_combinations,
+        "vendible": a,
+        "vendible_original": a.copy(),
+        "biomasa_final": b,
+        "no_pol": no_pol,
+        "descuento": descuento,
+        "restr_v": restr_v,
+        "restr_y": restr_y,
+        "restr_suave": restr_suave,
+        "restr_biom": restr_biom,
+        "biomasa_inicial": coefs["biomasa_base"][:, 0].copy(),
+        "clase": clase,
+        "n_clase": n_clase,
+        "miembros": miembros,
+        "R": R,
+        "H": H,
+    }
+
+
+def desagregar(miembros, solucion):
+    """Reparte una solución por clases {(clase, politica): cantidad} entre los rodales de cada clase.
+
+    Los rodales de una clase son intercambiables, así que se asignan en orden de índice.
+    Retorna la solución por rodal {(rodal, politica): 1}.
+    """
+    plan = {}
+    siguiente = {}
+    for (k, j), cantidad in sorted(solucion.items()):
+        inicio = siguiente.get(k, 0)
+        for r in miembros[k][inicio : inicio + int(round(cantidad))]:
+            plan[int(r), j] = 1
+        siguiente[k] = inicio + int(round(cantidad))
+    return plan
+
+
+def reoptimizar_horizonte(modelo, periodo, plan, perdidas=None):
+    """Re-optimiza los periodos restantes luego de quemar los periodos anteriores a `periodo`.
+
+    - fija las decisiones ya ejecutadas: cada rodal solo puede tomar políticas cuyo vendible en los
+      periodos < `periodo` coincida con el de su política en `plan` (o sin política si no ha vendido)
+    - escala el vendible de los periodos >= `periodo`, la biomasa final y la biomasa inicial de 4.7 por
+      (1 - perdidas[i]) de cada rodal (proporción quemada observada), actualizando el modelo en el lugar
+    - con pérdidas, 4.4 pasa a ser elástica: cada periodo t >= 1 recibe una holgura que ensancha la banda
+      de ±10% entre v[t-1] y v[t], penalizada en el objetivo con opti.penalizacion_suavizado veces el
+      mayor precio descontado por unidad. El periodo anterior ya está ejecutado y las pérdidas cambian el
+      vendible de cada rodal en distinta proporción, así que la banda rígida suele quedar infactible
+    - parte desde `plan` (solución previa, {(rodal, politica): 1}) como solución inicial
+
+    Las pérdidas se acumulan entre llamadas sucesivas sobre el mismo `modelo`. Con `periodo=0` y
+    `plan={}` equivale a resolver el modelo completo:
+
+        modelo = construir_modelo(rodales, politicas, prices)
+        plan, valor, v_t = reoptimizar_horizonte(modelo, 0, {})
+        for periodo in range(1, config["horizonte"]):
+            # ... quemar el periodo anterior y observar las pérdidas por rodal ...
+            plan, valor, v_t = reoptimizar_horizonte(modelo, periodo, plan, perdidas)
+
+    Retorna el nuevo plan, el valor objetivo (NPV, sin la penalización de las holguras) y los valores
+    v_t. Si el resto del horizonte queda infactible con las pérdidas observadas, levanta ValueError con
+    el estado de Gurobi.
+    """
+    if modelo["n_clase"].max() > 1:
+        raise ValueError("reoptimizar_horizonte requiere el modelo por rodal (formulacion.clases = false)")
+    model, x, v = modelo["model"], modelo["x"], modelo["v"]
+    a, a0, b, no_pol = modelo["vendible"], modelo["vendible_original"], modelo["biomasa_final"], modelo["no_pol"]
+    politica_plan = {i: j for (i, j) in plan}
+
+    # Actualizar coeficientes con las pérdidas observadas
+    if perdidas is not None:
+        factor = 1 - np.asarray(perdidas, dtype=float)
+        a[:, :, periodo:] *= factor[:, None, None]
+        b *= factor[:, None]
+        no_pol *= factor
+        # la biomasa inicial quemada tampoco se puede exigir al final del horizonte (4.7)
+        modelo["biomasa_inicial"] *= factor
+        modelo["restr_biom"].RHS = float(modelo["biomasa_inicial"].sum())
+        for i in modelo["R"]:
+            modelo["restr_y"][i].RHS = no_pol[i]
+        for i, j in modelo["valid_combinations"]:
+            x[i, j].Obj = float(a[i, j] @ modelo["descuento"])
+            model.chgCoeff(modelo["restr_y"][i], x[i, j], no_pol[i] - b[i, j])
+            for t in modelo["H"][periodo:]:
+                model.chgCoeff(modelo["restr_v"][t], x[i, j], a[i, j, t])
+        if "holgura" not in modelo:
+            penalizacion = config_opti["opti"]["penalizacion_suavizado"] * float(modelo["descuento"].max())
+            holgura = model.addVars(modelo["restr_suave"].keys(), obj=-penalizacion, name="holgura")
+            for t, (superior, inferior) in modelo["restr_suave"].items():
+                model.chgCoeff(superior, holgura[t], -1)
+                model.chgCoeff(inferior, holgura[t], 1)
+            modelo["holgura"] = holgura
+
+    # Fijar las decisiones de los periodos ya ejecutados
+    ejecutados = modelo.setdefault("ejecutados", set())
+    for i in modelo["R"]:
+        j0 = politica_plan.get(i)
+        pasado = a0[i, j0, :periodo] if j0 is not None else np.zeros(periodo)
+        politicas_i = [j for _, j in modelo["valid_combinations"].select(i, "*")]
+        compatibles = np.isclose(a0[i, politicas_i, :periodo], pasado).all(axis=1)
+        for j, compatible in zip(politicas_i, compatibles):
+            x[i, j].UB = 1 if compatible else 0
+        if pasado.any() and i not in ejecutados:
+            # ya se ejecutó un manejo: el rodal no puede volver a quedar sin política
+            model.addConstr(x.sum(i, "*") == 1)
+            ejecutados.add(i)
+
+    # Partir desde el plan previo
+    for i, j in modelo["valid_combinations"]:
+        x[i, j].Start = 1 if politica_plan.get(i) == j else 0
 
-    def callback(model, where):
-        if where == GRB.Callback.MIPSOL:
-            # Captura el valor del objetivo en soluciones factibles
-            obj_vals.append(model.cbGet(GRB.Callback.MIPSOL_OBJ))
-        if where == GRB.Callback.MIP:
-            # Captura el GAP actual en cada iteración del MIP
-            obj_bound = model.cbGet(GRB.Callback.MIP_OBJBND)
-            obj_best = model.cbGet(GRB.Callback.MIP_OBJBST)
-            if obj_best > 0:  # Evita divisiones por cero
-                gap = abs((obj_bound - obj_best) / obj_best) * 100
-                gaps.append(gap)
-
-    # Optimización del modelo
-    obj_vals = []
-    gaps = []
-    model.optimize(callback)
-
-    # Almacenar los valores del objetivo y GAP para la solución base
-    all_obj_vals.append(obj_vals.copy())
-    all_gaps.append(gaps.copy())
-
-    # Optimización de la solución base
     model.optimize()
+    if model.SolCount == 0:
+        raise ValueError(f"reoptimizar_horizonte: periodo {periodo} sin solución factible (estado {model.Status})")
+
+    plan_nuevo = {key: x[key].X for key in modelo["valid_combinations"] if x[key].X > 0.9}
+    valor = model.ObjVal
+    if "holgura" in modelo:
+        holgura = modelo["holgura"]
+        valor -= sum(holgura[t].Obj * holgura[t].X for t in holgura)
+        usada = {t: round(holgura[t].X, 1) for t in holgura if holgura[t].X > 1e-6}
+        if usada:
+            print(f"Periodo {periodo}: 4.4 relajada en {usada}")
+    return plan_nuevo, valor, [v[t].X for t in modelo["H"]]
+
+
+def soluciones_diversas(model, x, v, n_soluciones, num_cambios, optimizar=None, tiempo_limite=None):
+    """Resuelve `model` n_soluciones veces, exigiendo en cada una cambiar al menos `num_cambios` rodales
+    respecto de cada solución previa. `optimizar(sol_num)` reemplaza a model.optimize() si se entrega.
+
+    Con `tiempo_limite` (segundos para todo el lote, por defecto opti.tiempo_limite; 0 = sin límite) cada
+    resolución recibe el tiempo restante dividido por las soluciones que faltan, así el tiempo que sobra de
+    una pasa a las siguientes. Al vencer su parte se guarda el mejor incumbente con su gap; si aún no tiene
+    solución factible, la resolución continúa con todo el tiempo restante y el lote termina con ella si
+    tampoco la encuentra. TimeLimit vuelve a su valor original al salir.
+
+    Retorna las soluciones ({(rodal, politica): 1}, o cantidades por clase), los valores v_t, los valores
+    objetivo y los gaps (%) de cada solución. Lanza ValueError si no se encontró ninguna solución.
+    """
+    tiempo_limite = config_opti["opti"]["tiempo_limite"] if tiempo_limite is None else tiempo_limite
+    fin = time.monotonic() + tiempo_limite
+    limite_original = model.Params.TimeLimit
 
-    # Almacenar la solución base
     soluciones = []  # Lista para guardar las soluciones
     soluciones_v = []  # Para almacenar los valores de v_t
     valores_objetivo = []  # Lista para guardar los valores objetivo de cada solución
+    gaps = []  # Gap de cada solución al terminar su resolución
+
+    try:
+        for sol_num in range(n_soluciones):
+            # Agregar restricciones de diversidad respecto a la solución previa
+            # (con clases, x cuenta rodales y la restricción sobre la suma es conservadora)
+            if soluciones:
+                combinaciones_previas = list(soluciones[-1].keys())
+                model.addConstr(
+                    gp.quicksum(x[i, j] for (i, j) in combinaciones_previas)
+                    <= sum(soluciones[-1].values()) - num_cambios
+                )
+                model.update()
+
+            if tiempo_limite > 0:
+                restante = fin - time.monotonic()
+                if restante <= 0:
+                    print(f"Tiempo límite agotado: {sol_num} de {n_soluciones} soluciones generadas")
+                    break
+                model.setParam("TimeLimit", restante / (n_soluciones - sol_num))
+
+            while True:
+                if optimizar is None:
+                    model.optimize()
+                else:
+                    optimizar(sol_num)
+                restante = fin - time.monotonic()
+                if model.SolCount > 0 or model.Status != GRB.TIME_LIMIT or tiempo_limite <= 0 or restante <= 0:
+                    break
+                # Sin incumbente al vencer su parte: continúa (sin perder el árbol) con todo el tiempo restante
+                print(f"Solución {sol_num + 1} sin incumbente, continúa con los {restante:.0f} s restantes")
+                model.setParam("TimeLimit", restante)
+
+            if model.SolCount == 0:
+                print(f"Solución {sol_num + 1} sin incumbente factible (estado {model.Status}), se detiene el lote")
+                break
+
+            # Guardar la nueva solución generada (el mejor incumbente si se acabó el tiempo)
+            soluciones.append({key: round(x[key].X) for key in x.keys() if x[key].X > 0.9})
+            soluciones_v.append([v[t].X for t in sorted(v.keys())])
+            valores_objetivo.append(model.ObjVal)
+            gaps.append(model.MIPGap * 100)
+    finally:
+        model.setParam("TimeLimit", limite_original)
+
+    if not soluciones:
+        raise ValueError(f"soluciones_diversas: sin solución factible (estado {model.Status})")
+    return soluciones, soluciones_v, valores_objetivo, gaps
+
+
+def exportar_instancia(modelo, rodales, politicas, prices, dataset_name="", directorio=None):
+    """Exporta el modelo construido (sin restricciones de diversidad) a un directorio direccionado por contenido.
+
+    El directorio `{directorio}/{hash}` contiene el modelo (mps o lp), los parámetros de Gurobi (.prm) y
+    un meta.json con los rid de los rodales, las políticas y lo necesario para volver a generar las
+    soluciones. El hash se calcula sobre esos tres archivos, así que la misma instancia cae en el mismo
+    directorio. Retorna la ruta del directorio.
+    """
+    import hashlib
+    import shutil
+    import tempfile
+
+    instancias = config_opti["instancias"]
+    directorio = Path(instancias["directorio"] if directorio is None else directorio)
+    meta = {
+        "dataset_name": dataset_name,
+        "rids": [int(rodal["rid"]) for rodal in rodales],
+        "politicas": [[int(p) for p in politica] for politica in politicas],
+        "prices": [float(p) for p in prices],
+        "horizonte": len(modelo["H"]),
+        "soluciones": config_opti["opti"]["soluciones"],
+        "num_cambios": int(len(rodales) * 0.1),
+        "opti": config_opti["opti"],
+        "presolve": config_opti["presolve"],
+        "miembros": [[int(r) for r in m] for m in modelo["miembros"]],
+    }
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        temp_dir = Path(temp_dir)
+        archivos = [temp_dir / f"modelo.{instancias['formato']}", temp_dir / "parametros.prm", temp_dir / "meta.json"]
+        modelo["model"].write(str(archivos[0]))
+        modelo["model"].write(str(archivos[1]))
+        archivos[2].write_text(json.dumps(meta, indent=1, sort_keys=True))
+
+        sha = hashlib.sha256()
+        for archivo in archivos:
+            sha.update(archivo.read_bytes())
+        destino = directorio / sha.hexdigest()[:16]
+        destino.mkdir(parents=True, exist_ok=True)
+        for archivo in archivos:
+            shutil.copy(archivo, destino / archivo.name)
+
+    print(f"Instancia exportada en {destino}")
+    return destino
+
+
+def resolver_instancia(ruta, dataset_name=None, parametros=None):
+    """Re-resuelve una instancia exportada con `exportar_instancia` y escribe soluciones_{dataset_name}.csv.
+
+    `parametros` ({nombre: valor}) se aplican sobre los parámetros guardados, para comparar ajustes
+    del solver o versiones sobre exactamente la misma instancia.
+    Retorna los valores objetivo y las filas del csv, igual que model_t.
+    """
+    import re
+
+    ruta = Path(ruta)
+    meta = json.loads((ruta / "meta.json").read_text())
+    dataset_name = meta["dataset_name"] if dataset_name is None else dataset_name
+
+    modelo_archivo = next(ruta.glob("modelo.*"))
+    model = gp.read(str(modelo_archivo))
+    model.read(str(ruta / "parametros.prm"))
+    for nombre, valor in (parametros or {}).items():
+        model.setParam(nombre, valor)
+
+    # Recuperar las variables x[rodal,politica] y v[t] a partir de sus nombres
+    x, v = gp.tupledict(), gp.tupledict()
+    for var in model.getVars():
+        if m := re.fullmatch(r"x\[(\d+),(\d+)\]", var.VarName):
+            x[int(m[1]), int(m[2])] = var
+        elif m := re.fullmatch(r"v\[(\d+)\]", var.VarName):
+            v[int(m[1])] = var
+
+    soluciones, _, valores_objetivo, _ = soluciones_diversas(model, x, v, meta["soluciones"], meta["num_cambios"])
+    soluciones = [desagregar(meta["miembros"], sol) for sol in soluciones]
+    csv_rows = escribir_soluciones(soluciones, meta["rids"], meta["politicas"], dataset_name)
+    return valores_objetivo, csv_rows
 
-    solucion_generada = {key: x[key].X for key in valid_combinations if x[key].X > 0.9}
-    soluciones.append(solucion_generada.copy())  # Guardar copia de la solución base
-    soluciones_v.append([v[t].X for t in H])  # Guardar los valores de v_t para la solución base
-    valores_objetivo.append(model.ObjVal)  # Guardar el valor objetivo de la solución base
-
-    # Generar soluciones adicionales con restricciones de diversidad
-    num_cambios = int(len(rodales) * 0.1)  # Cambiar un 10% de los rodales
 
-    for sol_num in range(1, config_opti["opti"]["soluciones"]):  # Generar soluciones adicionales
-        obj_vals = []
-        gaps = []
+def model_t(rodales, politicas, prices, dataset_name):
+    """Modelo de optimización para maximizar el valor presente neto (NPV) de la venta de biomasa."""
+    tasa = config_opti["opti"]["tasa"]
+    RR = len(rodales)
+    modelo = construir_modelo(rodales, politicas, prices)
+    model, x, v = modelo["model"], modelo["x"], modelo["v"]
+    H = modelo["H"]
 
-        # Agregar restricciones de diversidad respecto a soluciones previas
-        for sol_prev in soluciones:
-            combinaciones_previas = list(sol_prev.keys())
-            model.addConstr(
-                gp.quicksum(x[i, j] for (i, j) in combinaciones_previas) <= len(combinaciones_previas) - num_cambios
-            )
+    # Registro del progreso del objetivo y gap (muestreado, ver callback_telemetria)
+    telemetria = config_opti["telemetria"]
+    directorio_trazas = Path(telemetria["directorio"])
+    all_trazas = []
 
-        # Optimizar el modelo con las restricciones de diversidad
-        model.update()
+    def optimizar(sol_num):
+        callback, traza = callback_telemetria(telemetria["intervalo"])
         model.optimize(callback)
-
-        # Guardar la nueva solución generada
-        solucion_generada = {key: x[key].X for key in valid_combinations if x[key].X > 0.9}
-        soluciones.append(solucion_generada.copy())  # Guardar copia de la solución generada
-        soluciones_v.append([v[t].X for t in H])  # Guardar los valores de v_t
-        valores_objetivo.append(model.ObjVal)  # Guardar el valor objetivo de la solución generada
-
-        # Almacenar los valores del objetivo y GAP para la solución actual
-        all_obj_vals.append(obj_vals.copy())
-        all_gaps.append(gaps.copy())
+        cerrar_traza(model, traza)
+        if sol_num < len(all_trazas):
+            # Continuación de una resolución sin incumbente: se agrega a su traza con el tiempo acumulado
+            desfase = all_trazas[sol_num][-1]["tiempo"] if all_trazas[sol_num] else 0
+            all_trazas[sol_num].extend({**fila, "tiempo": fila["tiempo"] + desfase} for fila in traza)
+        else:
+            all_trazas.append(traza)
+        escribir_traza(
+            all_trazas[sol_num], directorio_trazas / f"traza_{dataset_name}_solucion_{sol_num + 1}.{telemetria['formato']}"
+        )
+
+    if config_opti["instancias"]["exportar"]:
+        exportar_instancia(modelo, rodales, politicas, prices, dataset_name)
+
+    # Optimización de la solución base y soluciones adicionales con restricciones de diversidad
+    soluciones, soluciones_v, valores_objetivo, gaps = soluciones_diversas(
+        model, x, v, config_opti["opti"]["soluciones"], int(RR * 0.1), optimizar
+    )
+    soluciones = [desagregar(modelo["miembros"], sol) for sol in soluciones]
 
     # Generar gráfico del progreso del valor objetivo para todas las soluciones
     plt.figure(figsize=(10, 6))
-    for sol_num, obj_vals in enumerate(all_obj_vals):
-        plt.plot(range(len(obj_vals)), obj_vals, linestyle="-", label=f"Solución {sol_num + 1}")
+    for sol_num, traza in enumerate(all_trazas):
+        incumbentes = [f for f in traza if f["evento"] != "mip"]
+        tiempos = [f["tiempo"] for f in incumbentes]
+        plt.plot(tiempos, [f["incumbente"] for f in incumbentes], linestyle="-", label=f"Solución {sol_num + 1}")
     plt.title(f"Progreso del valor objetivo durante la optimización ({dataset_name})")
-    plt.xlabel("Iteraciones")
+    plt.xlabel("Tiempo (s)")
     plt.ylabel("Valor objetivo")
     plt.legend()
     plt.grid(True)
@@ -231,10 +635,13 @@ def model_t(rodales, politicas, prices, dataset_name):
 
     # Generar gráfico de la evolución del GAP para todas las soluciones
     plt.figure(figsize=(10, 6))
-    for sol_num, gaps in enumerate(all_gaps):
-        plt.plot(range(len(gaps)), gaps, linestyle="-", label=f"Solución {sol_num + 1}")
+    for sol_num, traza in enumerate(all_trazas):
+        muestras = [f for f in traza if f["gap"] is not None]
+        plt.plot(
+            [f["tiempo"] for f in muestras], [f["gap"] for f in muestras], linestyle="-", label=f"Solución {sol_num + 1}"
+        )
     plt.title(f"Evolución del GAP durante la optimización ({dataset_name})")
-    plt.xlabel("Iteraciones")
+    plt.xlabel("Tiempo (s)")
     plt.ylabel("GAP (%)")
     plt.yscale("log")  # Escala logarítmica para mejor visualización
     plt.legend()
@@ -264,38 +671,209 @@ def model_t(rodales, politicas, prices, dataset_name):
     # Guardar los valores objetivo en un archivo CSV
     with open(f"valores_objetivo_{dataset_name}.csv", mode="w", newline="") as file:
         writer = csv.writer(file)
-        writer.writerow(["Solución", "Valor Objetivo"])
+        writer.writerow(["Solución", "Valor Objetivo", "GAP (%)"])
+        writer.writerows([s + 1, valor, gap] for s, (valor, gap) in enumerate(zip(valores_objetivo, gaps)))
 
     print(f"Los valores objetivo de las soluciones se han guardado en el archivo valores_objetivo_{dataset_name}.csv.")
 
-    # Después de optimizar el modelo, guarda las soluciones en una lista
-    solutions = []
-    for sol in soluciones:
-        solution_dict = {}
-        for i, j in sol.keys():
-            solution_dict[i] = politicas[j]
-        solutions.append(solution_dict)
-
-    # Crear una lista de filas para el CSV, donde cada fila es un rodal y las columnas son las soluciones
-    csv_rows = []
-    headers = ["ID Rodal"] + [f"Solucion_{s + 1}" for s in range(len(solutions))]
-
-    # Iterar sobre cada rodal usando su ID
-    for i in range(RR):  # Itera sobre cada índice de rodal
-        rodal_id = rodales[i]["rid"]  # Obtén el ID del rodal
-        row = [rodal_id]  # Inicia la fila con el ID del rodal
-        for sol in solutions:
-            policy = sol.get(i, 0)  # Obtén la política seleccionada para el rodal i (si no hay, devuelve 0)
-            row.append(policy)  # Agrega la política seleccionada o 0 si no hay
-        csv_rows.append(row)
-
-    # Guardar en un archivo CSV
-    csv_filename = f"soluciones_{dataset_name}.csv"
-    with open(csv_filename, mode="w", newline="") as file:
+    # Guardar las soluciones en un archivo CSV (un rodal por fila, una solución por columna)
+    csv_rows = escribir_soluciones(soluciones, [rodal["rid"] for rodal in rodales], politicas, dataset_name)
+
+    return valores_objetivo, csv_rows
+
+
+def paisajes_plan(plan, coefs):
+    """Códigos Kitral de cada rodal en cada periodo, (T, R), para un plan (política por rodal, -1 = sin manejo)."""
+    plan = np.asarray(plan)
+    rodal = np.arange(len(plan))
+    return np.where(plan[:, None] >= 0, coefs["kitral"][rodal, np.maximum(plan, 0)], coefs["kitral_base"]).T
+
+
+def prob_quema(paisajes, simular, cache):
+    """Probabilidad de quema (R, T) de un plan a partir de sus paisajes por periodo.
+
+    Solo se simulan los paisajes (vector de códigos Kitral por rodal) que no están en `cache`;
+    `simular(paisajes)` recibe un arreglo (n, R) y retorna la probabilidad de quema (n, R) de cada rodal
+    en cada paisaje (NaN si no se pudo calcular). Igual que burn_prob_sol, la probabilidad del periodo t
+    es el promedio de los periodos 0..t.
+    """
+    claves = [tuple(int(c) for c in paisaje) for paisaje in paisajes]
+    nuevos = list(dict.fromkeys(clave for clave in claves if clave not in cache))
+    if nuevos:
+        for clave, bp in zip(nuevos, simular(np.array(nuevos))):
+            cache[clave] = np.nan_to_num(np.asarray(bp, dtype=float))
+    bp = np.array([cache[clave] for clave in claves]).T
+    return np.cumsum(bp, axis=1) / np.arange(1, bp.shape[1] + 1)
+
+
+def model_t_incendios(rodales, politicas, prices, dataset_name, simular, iteraciones=None, cache=None):
+    """Maximiza el NPV esperado con incendios alternando optimización y simulación.
+
+    En cada iteración el objetivo multiplica el vendible de cada rodal y periodo por (1 - bp) con la
+    probabilidad de quema del plan anterior (0 en la primera), se re-optimiza partiendo del plan anterior
+    y se simulan los incendios del nuevo plan con prob_quema. Termina cuando el plan se repite o al
+    llegar a `iteraciones` y se queda con el plan de mayor NPV esperado simulado. Las restricciones
+    4.2-4.7 se mantienen sobre el plan sin incendios.
+
+    `cache` ({paisaje: bp por rodal}) se puede compartir entre llamadas para no volver a simular paisajes.
+    Escribe soluciones_{dataset_name}.csv con ese plan. Retorna su NPV esperado, las filas del csv y su
+    probabilidad de quema bp[r][t].
+    """
+    iteraciones = config_opti["incendios"]["iteraciones"] if iteraciones is None else iteraciones
+    if iteraciones < 1:
+        raise ValueError("model_t_incendios requiere al menos una iteración (incendios.iteraciones)")
+    cache = {} if cache is None else cache
+    modelo = construir_modelo(rodales, politicas, prices)
+    if modelo["n_clase"].max() > 1:
+        raise ValueError("model_t_incendios requiere el modelo por rodal (formulacion.clases = false)")
+    model, x = modelo["model"], modelo["x"]
+    a, descuento = modelo["vendible"], modelo["descuento"]
+    coefs = coeficientes(rodales, politicas, len(modelo["H"]))
+    RR = len(rodales)
+
+    bp = np.zeros((RR, len(modelo["H"])))
+    plan = None
+    vistos = set()
+    mejor = None  # (NPV esperado, plan, bp)
+    for iteracion in range(iteraciones):
+        # NPV esperado con la probabilidad de quema del plan anterior
+        for i, j in modelo["valid_combinations"]:
+            x[i, j].Obj = float((a[i, j] * (1 - bp[i])) @ descuento)
+            if plan is not None:
+                x[i, j].Start = 1 if plan[i] == j else 0
+        model.optimize()
+        if model.SolCount == 0:
+            if plan is None:
+                raise ValueError("model_t_incendios: el modelo no tiene solución factible")
+            print(f"Iteración {iteracion + 1}: sin solución factible, se elige el mejor simulado")
+            break
+
+        plan_nuevo = asignacion([k for k in modelo["valid_combinations"] if x[k].X > 0.5], RR)
+        cambios = RR if plan is None else int((plan_nuevo != plan).sum())
+        if cambios == 0:
+            print(f"Iteración {iteracion + 1}: el plan se repite, NPV esperado {model.ObjVal:.2f}")
+            break
+        if plan_nuevo.tobytes() in vistos:
+            print(f"Iteración {iteracion + 1}: el plan vuelve a uno anterior (ciclo), se elige el mejor simulado")
+            break
+        vistos.add(plan_nuevo.tobytes())
+
+        simulados = len(cache)
+        bp = prob_quema(paisajes_plan(plan_nuevo, coefs), simular, cache)
+        plan = plan_nuevo
+        esperado = float(evaluar(plan, coefs, prices, bp=bp)["npv"])
+        if mejor is None or esperado > mejor[0]:
+            mejor = (esperado, plan, bp)
+        print(
+            f"Iteración {iteracion + 1}: NPV optimizado {model.ObjVal:.2f}, simulado {esperado:.2f}, "
+            f"{cambios} rodales cambian de política, {len(cache) - simulados} paisajes nuevos simulados "
+            f"({len(cache)} en caché)"
+        )
+
+    esperado, plan, bp = mejor
+    print(f"NPV esperado del plan elegido: {esperado:.2f}")
+
+    solucion = {(r, int(j)): 1 for r, j in enumerate(plan) if j >= 0}
+    csv_rows = escribir_soluciones([solucion], [rodal["rid"] for rodal in rodales], politicas, dataset_name)
+    return esperado, csv_rows, bp.tolist()
+
+
+def frontera_pareto(rodales, politicas, prices, bp, dataset_name, puntos=None):
+    """Frontera de Pareto entre el NPV y el vendible quemado esperado, con restricciones epsilon.
+
+    El vendible quemado esperado de x[i, j] es sum_t vendible[i, j, t] * bp[i, t] (bp[r][t] como lo
+    entrega burn_prob_sol para una solución, o bp[r][j][t] por política). Primero se resuelven los
+    extremos (mínimo vendible quemado y máximo NPV) y luego se maximiza el NPV con
+    vendible quemado <= epsilon para `puntos` valores crecientes entre ambos. Como cada epsilon relaja
+    el anterior, el punto previo es factible y se usa como solución inicial.
+
+    Escribe frontera_{dataset_name}.csv, frontera_{dataset_name}.png y las soluciones de cada punto en
+    soluciones_frontera_{dataset_name}.csv. Retorna los NPV, el vendible quemado de cada punto y las
+    filas del csv de soluciones.
+    """
+    puntos = config_opti["frontera"]["puntos"] if puntos is None else puntos
+    modelo = construir_modelo(rodales, politicas, prices)
+    if modelo["n_clase"].max() > 1:
+        raise ValueError("frontera_pareto requiere el modelo por rodal (formulacion.clases = false)")
+    model, x = modelo["model"], modelo["x"]
+    combinaciones = modelo["valid_combinations"]
+    a = modelo["vendible"]
+
+    bp = np.asarray(bp, dtype=float)
+    bp = np.broadcast_to(bp[:, None, :] if bp.ndim == 2 else bp, a.shape)
+    quemado = gp.quicksum(float(a[i, j] @ bp[i, j]) * x[i, j] for i, j in combinaciones)
+    model.update()
+    npv = model.getObjective()
+    inicio_total = time.monotonic()
+
+    # Extremos de la frontera
+    model.setObjective(quemado, GRB.MINIMIZE)
+    model.optimize()
+    if model.SolCount == 0:
+        raise ValueError("frontera_pareto: el modelo no tiene solución factible")
+    epsilon_min = model.ObjVal
+    inicio = {k: x[k].X for k in combinaciones}
+    model.setObjective(npv, GRB.MAXIMIZE)
+    model.optimize()
+    epsilon_max = quemado.getValue()
+    print(f"Vendible quemado esperado entre {epsilon_min:.2f} (mínimo) y {epsilon_max:.2f} (máximo NPV)")
+
+    restriccion = model.addConstr(quemado <= epsilon_max)
+    soluciones, valores_objetivo, quemados, filas = [], [], [], []
+    for punto, epsilon in enumerate(np.linspace(epsilon_min, epsilon_max, puntos)):
+        restriccion.RHS = epsilon + 1e-6 * max(1.0, abs(epsilon))  # holgura numérica en el extremo mínimo
+        for k in combinaciones:
+            x[k].Start = inicio[k]
+        inicio_punto = time.monotonic()
+        model.optimize()
+        if model.SolCount == 0:
+            print(f"Punto {punto + 1}: sin solución factible (estado {model.Status})")
+            continue
+
+        inicio = {k: x[k].X for k in combinaciones}
+        soluciones.append({k: 1 for k in combinaciones if x[k].X > 0.9})
+        valores_objetivo.append(model.ObjVal)
+        quemados.append(quemado.getValue())
+        filas.append([punto + 1, epsilon, model.ObjVal, quemados[-1], model.MIPGap * 100])
+        print(
+            f"Punto {punto + 1}: NPV {model.ObjVal:.2f}, vendible quemado {quemados[-1]:.2f} "
+            f"({time.monotonic() - inicio_punto:.2f} s)"
+        )
+    print(f"Frontera de {len(filas)} puntos en {time.monotonic() - inicio_total:.2f} s")
+
+    with open(f"frontera_{dataset_name}.csv", mode="w", newline="") as file:
         writer = csv.writer(file)
-        writer.writerow(headers)  # Escribir los encabezados
-        writer.writerows(csv_rows)  # Escribir las filas con los datos
+        writer.writerow(["Punto", "Epsilon", "Valor Objetivo", "Vendible quemado esperado", "GAP (%)"])
+        writer.writerows(filas)
 
-    print(f"Las soluciones de x[i,j] se han guardado en el archivo {csv_filename} con los IDs de los rodales.")
+    plt.figure(figsize=(10, 6))
+    plt.plot(quemados, valores_objetivo, marker="o", linestyle="-")
+    plt.title(f"Frontera NPV vs vendible quemado esperado ({dataset_name})")
+    plt.xlabel("Vendible quemado esperado")
+    plt.ylabel("NPV")
+    plt.grid(True)
+    plt.savefig(f"frontera_{dataset_name}.png")
+    plt.show()
 
-    return valores_objetivo, csv_rows
+    csv_rows = escribir_soluciones(
+        soluciones, [rodal["rid"] for rodal in rodales], politicas, f"frontera_{dataset_name}"
+    )
+    return valores_objetivo, quemados, csv_rows
+
+
+if __name__ == "__main__":
+    # verificación del horizonte rodante: con pérdidas típicas (hasta 30% por rodal) en los periodos 1 y 2
+    # la re-optimización del periodo 2 debe entregar un plan
+    from simulator import generate, generate_forest, print_manejos_possibles
+
+    rodales = generate(rodales=generate_forest())
+    politicas = print_manejos_possibles(config)
+    prices = generate_random_walk_prices(config_opti["opti"]["Price"], config["horizonte"], mu=0.05, sigma=0.1)
+    modelo = construir_modelo(rodales, politicas, prices)
+    modelo["model"].setParam("OutputFlag", 0)
+    plan, valor, _ = reoptimizar_horizonte(modelo, 0, {})
+    rng = np.random.default_rng(config["random"]["seed"])
+    for periodo in (1, 2):
+        plan, valor_periodo, _ = reoptimizar_horizonte(modelo, periodo, plan, rng.uniform(0, 0.3, len(rodales)))
+    assert plan, "reoptimizar_horizonte: el periodo 2 no entregó un plan"
+    print(f"Periodo 2 re-optimizado: {len(plan)} rodales con política, NPV {valor:.0f} -> {valor_periodo:.0f}")
@@ -5,7 +5,7 @@ without launching the QGIS GUI.
 2. Enables a user located processing plugin to be loaded
 
 Programmers must:
-1. Adjust the path to the QGIS installation
+1. Adjust the paths to the QGIS installation and plugins in [qgis] of config_opti.toml
 (on windows also adjust qgis versions)
 
 2. load the QGIS python environment to run
@@ -20,16 +20,23 @@ https://fire2a.github.io/docs/docs/qgis/README.html
 https://gis.stackexchange.com/a/408738
 https://gis.stackexchange.com/a/172849
 """
+import hashlib
+import json
+import os
 import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
 from platform import system as platform_system
 from shutil import which
 from os import pathsep, environ
 
-from qgis.core import QgsApplication, QgsRasterLayer
 import numpy as np
 import tempfile
 from pathlib import Path
 
+from post_optimization import bootstrap_npv, guardar_bp, intervalos_separados, tensor_filtro
+
 
 if sys.version_info >= (3, 11):
     import tomllib
@@ -54,45 +61,103 @@ else:
 #
 ## PART 1
 #
-if platform_system() == "Windows":
-    QgsApplication.setPrefixPath("C:\\PROGRA~1\\QGIS33~1.2", True)
-else:
-    QgsApplication.setPrefixPath("/usr", True)
-qgs = QgsApplication([], False)
-qgs.initQgis()
-
-# Append the path where processing plugin can be found
-if platform_system() == "Windows":
-    sys.path.append("C:\\PROGRA~1\\QGIS33~1.2\\apps\\qgis\\python\\plugins")
-else:
-    sys.path.append("/usr/share/qgis/python/plugins")
-
-import processing
-from processing.core.Processing import Processing
-
-Processing.initialize()
-
-if platform_system() == "Windows":
-    sys.path.append("C:\\Users\\xunxo\\AppData\\Roaming\\QGIS\\QGIS3\\profiles\\default\\python\\plugins")
-else:
-    sys.path.append("/home/fdo/.local/share/QGIS/QGIS3/profiles/default/python/plugins/")
-# Add the algorithm provider
-from fireanalyticstoolbox.fireanalyticstoolbox_provider import FireToolboxProvider
+# QGIS se inicia al primer uso (iniciar_qgis), una vez por proceso
+qgs = None
+processing = None
+proveedor = None
 
-provider = FireToolboxProvider()
-QgsApplication.processingRegistry().addProvider(provider)
 
-print(processing.algorithmHelp("gdal:rasterize"))
+def iniciar_qgis():
+    """Inicia QGIS sin interfaz, Processing y el FireToolboxProvider de fire2a si aún no están en este proceso.
 
-
-def fuels_tif(temp_path, category, output):
-    """Crea Raster de combustibles a partir de un shapefile y una columna de categoria."""
+    Las rutas de la instalación y de los plugins se leen de [qgis] en config_opti.toml.
+    """
+    global qgs, processing, proveedor
+    if qgs is not None:
+        return
+    inicio = time.perf_counter()
+    from qgis.core import QgsApplication
+
+    rutas = config_opti["qgis"]
+    windows = platform_system() == "Windows"
+    QgsApplication.setPrefixPath(rutas["prefijo_windows"] if windows else rutas["prefijo"], True)
+    app = QgsApplication([], False)
+    app.initQgis()
+
+    # Append the path where processing plugin can be found
+    sys.path.append(rutas["plugins_windows"] if windows else rutas["plugins"])
+    import processing as modulo_processing
+    from processing.core.Processing import Processing
+
+    Processing.initialize()
+
+    sys.path.append(os.path.expanduser(rutas["perfil_windows"] if windows else rutas["perfil"]))
+    # Add the algorithm provider
+    from fireanalyticstoolbox.fireanalyticstoolbox_provider import FireToolboxProvider
+
+    proveedor = FireToolboxProvider()
+    QgsApplication.processingRegistry().addProvider(proveedor)
+    qgs, processing = app, modulo_processing
+    print(f"QGIS iniciado en {time.perf_counter() - inicio:.2f} s")
+
+
+# Parámetros de fire2a:cell2firesimulator comunes a todas las simulaciones (sin FuelRaster ni FireBreaksRaster)
+PARAMETROS_C2F = {
+    "CbdRaster": None,
+    "CbhRaster": None,
+    "CcfRaster": None,
+    "DryRun": False,
+    "ElevationRaster": None,
+    "EnableCrownFire": False,
+    "FoliarMoistureContent": 66,
+    "FuelModel": 1,
+    "IgnitionMode": 0,
+    "IgnitionPointVectorLayer": None,
+    "IgnitionProbabilityMap": None,
+    "IgnitionRadius": 0,
+    "InstanceDirectory": "TEMPORARY_OUTPUT",
+    "InstanceInProject": False,
+    "LiveAndDeadFuelMoistureContentScenario": 2,
+    "NumberOfSimulations": 50,
+    "OtherCliArgs": "",
+    "OutputOptions": [1, 2, 3, 4],
+    "RandomNumberGeneratorSeed": 123,
+    "ResultsDirectory": "TEMPORARY_OUTPUT",
+    "ResultsInInstance": True,
+    "SetFuelLayerStyle": False,
+    "SimulationThreads": 15,
+    "WeatherDirectory": "",
+    "WeatherFile": ".\\example\\Weather.csv",
+    "WeatherMode": 0,
+}
+
+
+def extension_capa(ruta):
+    """Extensión de una capa vectorial en el formato de gdal:rasterize, "xmin,xmax,ymin,ymax [EPSG:...]"."""
+    iniciar_qgis()
+    from qgis.core import QgsVectorLayer
+
+    capa = QgsVectorLayer(str(ruta), "capa", "ogr")
+    e = capa.extent()
+    return f"{e.xMinimum()},{e.xMaximum()},{e.yMinimum()},{e.yMaximum()} [{capa.crs().authid()}]"
+
+
+def fuels_tif(temp_path, category, output, extent=None):
+    """Crea Raster de combustibles a partir de un shapefile y una columna de categoria.
+
+    Sin `extent` se usa la extensión de la capa (extension_capa). Con simulador.backend = "numpy" se
+    rasteriza con gdal directamente, con la misma grilla, para no iniciar QGIS.
+    """
+    if config_opti["simulador"]["backend"] == "numpy":
+        rasterizar_gdal(temp_path, category, output, extent)
+        return
+    iniciar_qgis()
     fuels = processing.run(
         "gdal:rasterize",
         {
             "BURN": 0,
             "DATA_TYPE": 4,
-            "EXTENT": "635415.270700000,638547.761600000,5835896.684200000,5838559.301400000 [EPSG:32718]",
+            "EXTENT": extension_capa(temp_path) if extent is None else extent,
             "EXTRA": "",
             "FIELD": category,
             "HEIGHT": 30,
@@ -109,12 +174,47 @@ def fuels_tif(temp_path, category, output):
     )
 
 
-from concurrent.futures import ThreadPoolExecutor
+def rasterizar_gdal(temp_path, category, output, extent=None):
+    """gdal:rasterize de fuels_tif sin QGIS: celdas de 30 unidades, Int32 y nodata -9999."""
+    from osgeo import gdal
+
+    opciones = {"attribute": category, "xRes": 30, "yRes": 30, "outputType": gdal.GDT_Int32}
+    if extent is not None:
+        xmin, xmax, ymin, ymax = map(float, extent.split(" [")[0].split(","))
+        opciones["outputBounds"] = (xmin, ymin, xmax, ymax)
+    raster = gdal.Rasterize(str(output), str(temp_path), noData=-9999, initValues=-9999, **opciones)
+    if raster is None:
+        raise ValueError(f"no se pudo rasterizar {temp_path} por {category}")
+    raster = None  # cierra el archivo
+
+
 import tempfile
 from pathlib import Path
 
 
-def burn_prob(apath, temp_dir, fire_breaks=None, paisaje=".\\test\\data_base\\proto.shp"):
+def huella(archivos, parametros):
+    """sha256 del contenido de `archivos` (None se ignora) y de `parametros`, para el cache de burn_prob."""
+    sha = hashlib.sha256(json.dumps(parametros, sort_keys=True).encode())
+    for archivo in archivos:
+        sha.update(b"\0")
+        if archivo is not None:
+            sha.update(Path(archivo).read_bytes())
+    return sha.hexdigest()[:32]
+
+
+def podar_cache(directorio, max_mb):
+    """Borra los resultados usados hace más tiempo hasta que el cache pese a lo más `max_mb`."""
+    archivos = sorted(Path(directorio).glob("*.pkl"), key=lambda p: p.stat().st_mtime)
+    total = sum(p.stat().st_size for p in archivos)
+    while archivos and total > max_mb * 2**20:
+        archivo = archivos.pop(0)
+        total -= archivo.stat().st_size
+        archivo.unlink(missing_ok=True)
+
+
+def burn_prob(
+    apath, temp_dir, fire_breaks=None, paisaje=".\\test\\data_base\\proto.shp", hilos=None, grilla=None, id="fid"
+):
     """
     Simulate burn probability using the specified fuel raster and optional fire breaks.
 
@@ -122,82 +222,141 @@ def burn_prob(apath, temp_dir, fire_breaks=None, paisaje=".\\test\\data_base\\pr
         apath (str): Path to the fuel raster file.
         temp_dir (str): Path to the temporary directory for storing intermediate files.
         fire_breacks (str, optional): Path to the fire breaks raster file. Defaults to None.
+        hilos (int, optional): SimulationThreads of Cell2Fire. Defaults to PARAMETROS_C2F.
+        grilla (tuple, optional): (rid_idx, rids) from grilla_rid; the zonal statistics are then computed
+            with estadisticas_zonales instead of native:zonalstatisticsfb. Defaults to None.
+        id (str, optional): Name of the rodal id column when `grilla` is given. Defaults to "fid".
 
     Returns:
         DataFrame: DataFrame containing burn probabilities for each rodal.
     """
+    import pandas as pd
+
+    from auxiliary import get_data
+
+    cache = config_opti["cache"]
+    simulador = config_opti["simulador"]
+    parametros = {**PARAMETROS_C2F, "FuelRaster": apath, "FireBreaksRaster": fire_breaks}
+    if hilos is not None:
+        parametros["SimulationThreads"] = hilos
+    if cache["activo"]:
+        capa = Path(paisaje)
+        archivos = [apath, fire_breaks, *sorted(capa.parent.glob(f"{capa.stem}.*"))]
+        # el clima y los parámetros de Cell2Fire solo cuentan con su backend; sus hilos no cambian el resultado
+        if simulador["backend"] == "numpy":
+            motor = simulador
+        else:
+            archivos.append(parametros["WeatherFile"])
+            motor = {k: v for k, v in PARAMETROS_C2F.items() if k != "SimulationThreads"}
+        clave = huella(archivos, {**motor, "zonal": None if grilla is None else [id, [str(rid) for rid in grilla[1]]]})
+        ruta_cache = Path(cache["directorio"]) / f"{clave}.pkl"
+        if ruta_cache.exists():
+            os.utime(ruta_cache)  # marca de uso para la poda
+            return pd.read_pickle(ruta_cache)
+
     # Crear una nueva ruta para el archivo .shp en el directorio temporal
     temp_output_path = Path(temp_dir) / "mean_bp.shp"
-    result = processing.run(
-        "fire2a:cell2firesimulator",
-        {
-            "CbdRaster": None,
-            "CbhRaster": None,
-            "CcfRaster": None,
-            "DryRun": False,
-            "ElevationRaster": None,
-            "EnableCrownFire": False,
-            "FireBreaksRaster": fire_breaks,
-            "FoliarMoistureContent": 66,
-            "FuelModel": 1,
-            "FuelRaster": apath,
-            "IgnitionMode": 0,
-            "IgnitionPointVectorLayer": None,
-            "IgnitionProbabilityMap": None,
-            "IgnitionRadius": 0,
-            "InstanceDirectory": "TEMPORARY_OUTPUT",
-            "InstanceInProject": False,
-            "LiveAndDeadFuelMoistureContentScenario": 2,
-            "NumberOfSimulations": 50,
-            "OtherCliArgs": "",
-            "OutputOptions": [1, 2, 3, 4],
-            "RandomNumberGeneratorSeed": 123,
-            "ResultsDirectory": "TEMPORARY_OUTPUT",
-            "ResultsInInstance": True,
-            "SetFuelLayerStyle": False,
-            "SimulationThreads": 15,
-            "WeatherDirectory": "",
-            "WeatherFile": ".\\example\\Weather.csv",
-            "WeatherMode": 0,
-        },
-    )
-    if rd := result.get("ResultsDirectory"):
-        pass
+    if simulador["backend"] == "numpy":
+        from incendios_numpy import burn_prob_raster
+
+        raster_probabilidad = burn_prob_raster(apath, Path(temp_dir) / "bp.tif", fire_breaks)
     else:
-        print("eerrrrr")
+        iniciar_qgis()
+        result = processing.run("fire2a:cell2firesimulator", parametros)
+        if rd := result.get("ResultsDirectory"):
+            pass
+        else:
+            print("eerrrrr")
+
+        bundle = processing.run(
+            "fire2a:simulationresultsprocessing",
+            {
+                "BaseLayer": apath,
+                "EnablePropagationDiGraph": True,
+                "EnablePropagationScars": False,
+                "OutputDirectory": "TEMPORARY_OUTPUT",
+                "ResultsDirectory": result["ResultsDirectory"],
+            },
+        )
+        raster_probabilidad = bundle["BurnProbability"]
+
+    if grilla is not None:
+        from fire2a.raster import read_raster
+
+        rid_idx, rids = grilla
+        valores, info = read_raster(str(raster_probabilidad))
+        if valores.shape != rid_idx.shape:
+            raise ValueError(f"la grilla de rodales {rid_idx.shape} no coincide con el raster {valores.shape}")
+        zonas = estadisticas_zonales(valores, rid_idx, len(rids), nodata=info["NoDataValue"])
+        burn_prob = pd.DataFrame({id: rids, "_mean": zonas["mean"], "_max": zonas["max"], "_count": zonas["count"]})
+    else:
+        iniciar_qgis()
+        raster_bp = processing.run(
+            "native:zonalstatisticsfb",
+            {
+                "COLUMN_PREFIX": "_",
+                "INPUT": paisaje,
+                "INPUT_RASTER": str(raster_probabilidad),
+                "OUTPUT": str(temp_output_path),
+                "RASTER_BAND": 1,
+                "STATISTICS": [2, 6],
+            },
+        )
+        burn_prob = get_data(str(raster_bp["OUTPUT"]))
+    burn_prob = burn_prob.fillna(0)
 
-    bundle = processing.run(
-        "fire2a:simulationresultsprocessing",
-        {
-            "BaseLayer": apath,
-            "EnablePropagationDiGraph": True,
-            "EnablePropagationScars": False,
-            "OutputDirectory": "TEMPORARY_OUTPUT",
-            "ResultsDirectory": result["ResultsDirectory"],
-        },
-    )
+    if cache["activo"]:
+        # escritura atómica: otro proceso nunca lee un archivo a medio escribir
+        ruta_cache.parent.mkdir(parents=True, exist_ok=True)
+        temporal = ruta_cache.with_name(f"{ruta_cache.stem}.{os.getpid()}.tmp")
+        burn_prob.to_pickle(temporal)
+        os.replace(temporal, ruta_cache)
+        podar_cache(cache["directorio"], cache["max_mb"])
 
-    raster_bp = processing.run(
-        "native:zonalstatisticsfb",
-        {
-            "COLUMN_PREFIX": "_",
-            "INPUT": paisaje,
-            "INPUT_RASTER": bundle["BurnProbability"],
-            "OUTPUT": str(temp_output_path),
-            "RASTER_BAND": 1,
-            "STATISTICS": [2, 6],
-        },
-    )
-    from auxiliary import get_data
+    return burn_prob
 
-    burn_prob = get_data(str(raster_bp["OUTPUT"]))
-    burn_prob = burn_prob.fillna(0)
 
-    return burn_prob
+def bp_rodales(apath, temp_dir, fire_breaks, paisaje, id, rids, hilos=None, rid_idx=None):
+    """burn_prob en su propio directorio `temp_dir`; retorna el _mean de cada rodal de `rids` (NaN si falta).
+
+    Con la grilla `rid_idx` de grilla_rid la estadística zonal se calcula con estadisticas_zonales.
+    """
+    Path(temp_dir).mkdir(parents=True, exist_ok=True)
+    grilla = None if rid_idx is None else (rid_idx, rids)
+    resultado = burn_prob(apath, temp_dir, fire_breaks, paisaje, hilos, grilla, id)
+    return resultado.set_index(id)["_mean"].reindex(rids).to_numpy(dtype=float)
+
+
+def simular_rasters(rutas, temp_dir, fire_breaks, paisaje, id, rids, rid_idx=None):
+    """Probabilidad de quema media de cada rodal para cada raster de combustibles de `rutas`, (n, R).
+
+    Con incendios.procesos > 1 los rasters se simulan en procesos separados (cada uno inicia su propio
+    QGIS) y en directorios distintos; los hilos de incendios.hilos se reparten entre ellos y el resultado
+    queda en el orden de `rutas`.
+    """
+    incendios = config_opti["incendios"]
+    procesos = max(1, min(incendios["procesos"] or os.cpu_count(), len(rutas)))
+    hilos = max(1, (incendios["hilos"] or os.cpu_count()) // procesos)
+    n = len(rutas)
+    directorios = [str(Path(temp_dir) / f"paisaje_{k}") for k in range(n)]
+    if procesos == 1:
+        filas = [bp_rodales(r, d, fire_breaks, paisaje, id, rids, hilos, rid_idx) for r, d in zip(rutas, directorios)]
+    else:
+        with ProcessPoolExecutor(max_workers=procesos, mp_context=get_context("spawn")) as pool:
+            constantes = [[fire_breaks] * n, [paisaje] * n, [id] * n, [rids] * n, [hilos] * n, [rid_idx] * n]
+            filas = list(pool.map(bp_rodales, rutas, directorios, *constantes))
+    return np.array(filas).reshape(n, len(rids))
 
 
 def burn_prob_sol(
-    num_soluciones, formato, filtro, input, corta_fuegos=False, id="fid", paisaje="test\\data_base\\proto.shp"
+    num_soluciones,
+    formato,
+    filtro,
+    input,
+    corta_fuegos=False,
+    id="fid",
+    paisaje="test\\data_base\\proto.shp",
+    salida=None,
 ):
     """
     Calculate burn probability for multiple solutions over different periods.
@@ -208,142 +367,336 @@ def burn_prob_sol(
         filtro (list): List of filters for each solution and period.
         input (str): Path to the input directory.
         corta_fuegos (bool, optional): Whether to use fire breaks. Defaults to False.
+        salida (str, optional): Directory where the result is also saved with post_optimization.guardar_bp.
 
     Returns:
-        list: Nested list containing burn probabilities for each solution, rodal, and period.
+        np.ndarray: Burn probabilities (S, R, T) for each solution, rodal, and period, NaN where the fuel
+        file or the rodal was not found (post_optimization raises on NaN).
     """
-    periodos = config["horizonte"]
-    bp = []
+    rids = [rodal["rid"] for rodal in filtro[0].values()]
+    fire_breaks = r".\\cortafuegos\\cortafuego_2%.tif" if corta_fuegos else None
     temp_dir = tempfile.TemporaryDirectory()
     # Crear una nueva ruta para el directorio temporal
     temp_dir_path = Path(temp_dir.name)
     input_path = Path(input)
 
-    # Iterar sobre todas las soluciones
-    for s in range(num_soluciones):
-        solucion_bp = []
-        # Iterar sobre todos los periodos para la solución actual
-        for t in range(periodos):
-            # Construir la ruta al archivo utilizando f-strings y Path
-            path_p = input_path / f"fuels_solucion_{s}_periodo_{t}{formato}"
-
-            if path_p.exists():
-                if corta_fuegos == False:
-                    # Llamar a la función `burn_prob` con la ruta correcta
-                    bp_rodales = burn_prob(str(path_p), str(temp_dir_path), None, paisaje)
-                else:
-                    fire_breaks = r".\\cortafuegos\\cortafuego_2%.tif"
-                    bp_rodales = burn_prob(str(path_p), str(temp_dir_path), fire_breaks, paisaje)
-
-            else:
-                print(f"File {path_p} does not exist.")
-                continue  # Saltar a la siguiente iteración si el archivo no existe
-
-            bp_periodo = []
-            for r in range(len(filtro[0])):
-                # Filtrar por el 'fid' de cada rodal y obtener el valor de "_mean"
-                bp_valor = bp_rodales.loc[bp_rodales[id] == filtro[s][r]["rid"], "_mean"].values
-                if len(bp_valor) > 0:
-                    bp_periodo.append(bp_valor[0])
-                else:
-                    bp_periodo.append(None)  # Manejar casos donde no se encuentra el 'fid'
-
-            solucion_bp.append(bp_periodo)
-
-        # Reorganizar para tener una lista de listas (por rodal) con valores por periodo
-        reorganizado = list(map(list, zip(*solucion_bp)))
-
-        # Calcular el promedio acumulado de cada valor con todos los periodos anteriores para esta solución
-        promedios_solucion = []
-        for fila in reorganizado:
-            promedios_fila = []
-            suma_acumulada = 0  # Para llevar el seguimiento de la suma de valores
-            for i, valor in enumerate(fila):
-                if valor is not None:
-                    suma_acumulada += valor
-                    promedio = suma_acumulada / (i + 1)
-                else:
-                    promedio = None  # Si el valor es None, el promedio también es None
-                promedios_fila.append(promedio)
-
-            promedios_solucion.append(promedios_fila)
-
-        # Guardar los promedios de la solución actual en la lista final
-        bp.append(promedios_solucion)
-
-    return bp  # Devuelve bp[s][r][t] donde s es la solución, r es el rodal y t el periodo
-
-
-def fuels_creation(gdf, filtro, output, id="fid"):
-    """Crea los combustibles a partir de geopandas y los filtros de las soluciones (los combustibles de las soluciones)s"""
-    gdf_temp = gdf.copy()
-    periodos = config["horizonte"]
-    base_dir = Path(output)
+    # Cada paisaje distinto se simula una sola vez, con el archivo de la primera (s, t) que lo tiene
+    paisaje_st, primeros = paisajes_unicos(filtro, num_soluciones)
+    bp_paisajes = np.full((len(primeros), len(rids)), np.nan)
+    existentes = []
+    for u, (s, t) in enumerate(primeros):
+        path_p = input_path / f"fuels_solucion_{s}_periodo_{t}{formato}"
+        if not path_p.exists():
+            print(f"File {path_p} does not exist.")
+            continue
+        existentes.append((u, str(path_p)))
+    if existentes:
+        u, rutas = zip(*existentes)
+        rid_idx, _ = grilla_rid(paisaje, rids, temp_dir_path, id)
+        bp_paisajes[list(u)] = simular_rasters(rutas, temp_dir_path, fire_breaks, paisaje, id, rids, rid_idx)
+
+    # bp[s, r, t]: promedio acumulado de cada rodal con los periodos anteriores (NaN si no se encuentra)
+    bp_st = bp_paisajes[paisaje_st].transpose(0, 2, 1)
+    promedios = np.nancumsum(bp_st, axis=-1) / np.arange(1, bp_st.shape[-1] + 1)
+    bp = np.where(np.isnan(bp_st), np.nan, promedios)
+
+    if salida is not None:
+        guardar_bp(bp, salida, [rodal["rid"] for rodal in filtro[0].values()])
+
+    return bp  # Devuelve bp[s, r, t] donde s es la solución, r es el rodal y t el periodo
+
+
+def grilla_rid(paisaje, rids, temp_dir, id="fid"):
+    """Rasteriza `paisaje` por `id` una sola vez y retorna la grilla (alto, ancho) con el índice en `rids`
+    del rodal de cada celda (-1 fuera de los rodales) y la info del raster (read_raster).
+    """
+    from fire2a.raster import read_raster
 
-    for s in range(len(filtro)):  # soluciones
-        for t in range(periodos):
-            for r in range(len(filtro[0])):  # rodales
-                gdf_temp.loc[gdf_temp[id] == filtro[s][r]["rid"], "kitral_cod"] = filtro[s][r]["codigo_kitral"][t]
-            # Directorio base
+    salida = Path(temp_dir) / "rid.tif"
+    fuels_tif(paisaje, id, salida)
+    grilla, info = read_raster(str(salida))
+    return indice_en(grilla, rids), info
 
-            temp_dir = tempfile.TemporaryDirectory()
-            # Crear un objeto Path para el archivo temporal .shp
-            shp_path = Path(temp_dir.name) / "temp_file.shp"
-            # Guardar el GeoDataFrame como un shapefile
-            gdf_temp.to_file(shp_path)
 
-            # Nombre del archivo con variables dinámicas
-            file_name = f"fuels_solucion_{s}_periodo_{t}.tif"
-            # Ruta completa al archivo
+def indice_en(valores, rids):
+    """Posición en `rids` de cada elemento de `valores` (-1 si no está)."""
+    valores, rids = np.asarray(valores), np.asarray(rids)
+    orden = np.argsort(rids)
+    posicion = np.minimum(np.searchsorted(rids, valores, sorter=orden), len(rids) - 1)
+    return np.where(rids[orden[posicion]] == valores, orden[posicion], -1)
 
-            base_path = base_dir / file_name
 
-            # Eliminar el archivo si ya existe para asegurarse de que se reescriba
-            if base_path.exists():
-                base_path.unlink()
+def grilla_poligonos(gdf, temp_dir):
+    """Rasteriza una sola vez el número de fila de cada polígono de `gdf` (-1 fuera de los polígonos).
 
-            fuels_tif(str(shp_path), "kitral_cod", base_path)
-    print("combustibles en carpeta de soluciones")
+    Retorna la grilla (alto, ancho) y la info del raster; los rasters de raster_rodales con tablas por
+    polígono usan esta misma grilla.
+    """
+    from fire2a.raster import read_raster
 
+    capa = gdf[["geometry"]].copy()
+    capa["poligono"] = np.arange(len(gdf))
+    shp_path = Path(temp_dir) / "poligonos.shp"
+    capa.to_file(shp_path)
+    salida = Path(temp_dir) / "poligonos.tif"
+    fuels_tif(shp_path, "poligono", salida)
+    grilla, info = read_raster(str(salida))
+    return np.where((grilla >= 0) & (grilla < len(gdf)), grilla, -1).astype(int), info
 
-def protection_value(path_fuels, path_biomass):
+
+def tabla_poligonos(base, rodal, valores):
+    """Valor de cada polígono: `base` (el del shapefile), salvo los polígonos de rodales (`rodal` >= 0,
+    posición en el orden de `valores`), que toman valores[rodal].
     """
-    Calculate the protection value using the specified fuel and biomass rasters."""
-    from fire2a.raster import read_raster
+    tabla = np.array(base, dtype=np.result_type(np.asarray(base), np.asarray(valores)))
+    es_rodal = rodal >= 0
+    tabla[es_rodal] = np.asarray(valores)[rodal[es_rodal]]
+    return tabla
+
+
+def estadisticas_zonales(valores, rid_idx, n_rodales, cuantiles=(), nodata=None):
+    """Estadística zonal de un raster por rodal sobre la grilla de grilla_rid, sin capas vectoriales.
+
+    Ignora las celdas fuera de los rodales (rid_idx -1), NaN o iguales a `nodata`. Retorna arreglos en el
+    orden de los rodales: "mean", "max" y "count" (R,) y, si se piden, "cuantiles" (R, len(cuantiles)) con
+    interpolación lineal como np.quantile; NaN para rodales sin celdas.
+    """
+    valores = np.asarray(valores, dtype=float).ravel()
+    rid_idx = np.asarray(rid_idx).ravel()
+    validas = (rid_idx >= 0) & np.isfinite(valores)
+    if nodata is not None:
+        validas &= valores != nodata
+    r, v = rid_idx[validas], valores[validas]
+
+    count = np.bincount(r, minlength=n_rodales)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean = np.bincount(r, weights=v, minlength=n_rodales) / count
+    maximo = np.full(n_rodales, -np.inf)
+    np.maximum.at(maximo, r, v)
+    zonas = {"mean": mean, "max": np.where(count > 0, maximo, np.nan), "count": count}
+
+    if len(cuantiles):
+        # ordenados por rodal y luego por valor: cada rodal es un tramo contiguo de `v`
+        v = v[np.lexsort((v, r))]
+        inicio = np.cumsum(count) - count
+        posicion = inicio[:, None] + np.asarray(cuantiles)[None, :] * np.maximum(count - 1, 0)[:, None]
+        abajo = np.floor(posicion).astype(int)
+        arriba = np.minimum(abajo + 1, (inicio + np.maximum(count - 1, 0))[:, None])
+        abajo, arriba = np.minimum(abajo, len(v) - 1), np.minimum(arriba, len(v) - 1)
+        fraccion = posicion - np.floor(posicion)
+        q = v[abajo] + (v[arriba] - v[abajo]) * fraccion if len(v) else np.full(posicion.shape, np.nan)
+        zonas["cuantiles"] = np.where(count[:, None] > 0, q, np.nan)
+    return zonas
+
+
+def raster_rodales(valores, rid_idx, info, output, nodata=-9999):
+    """Escribe el raster con valores[i] en las celdas de índice i de la grilla `rid_idx` (de rodales o de
+    polígonos) y `nodata` en las celdas -1.
+
+    Si `output` termina en .asc se escribe el ASCII de Cell2Fire; si no, GeoTIFF con la grilla de `info`.
+    """
+    tabla = np.append(np.asarray(valores), nodata)
+    raster = tabla[rid_idx]
+    if Path(output).suffix == ".asc":
+        x0, ancho, _, y0, _, alto = info["Transform"]
+        encabezado = (
+            f"ncols {raster.shape[1]}\nnrows {raster.shape[0]}\nxllcorner {x0}\n"
+            f"yllcorner {y0 + alto * raster.shape[0]}\ncellsize {ancho}\nNODATA_value {nodata}"
+        )
+        fmt = "%d" if np.issubdtype(raster.dtype, np.integer) else "%.6g"
+        np.savetxt(output, raster, fmt=fmt, header=encabezado, comments="")
+        return
+    from fire2a.raster import write_raster
+
+    write_raster(raster, str(output), "GTiff", info["Projection"], info["Transform"], nodata=nodata)
+
+
+def paisajes_unicos(filtro, num_soluciones=None):
+    """Agrupa las (solución, periodo) de `filtro` con la misma asignación de códigos Kitral por rodal.
+
+    Retorna el índice del paisaje único de cada (s, t), (S, T), y la primera (s, t) de cada paisaje, (U, 2).
+    """
+    soluciones = filtro[:num_soluciones]
+    kitral = np.array([[rodal["codigo_kitral"] for rodal in solucion.values()] for solucion in soluciones])
+    S, R, T = kitral.shape
+    _, primeros, inversa = np.unique(
+        kitral.transpose(0, 2, 1).reshape(S * T, R), axis=0, return_index=True, return_inverse=True
+    )
+    print(f"{len(primeros)} paisajes distintos de {S * T} (soluciones x periodos)")
+    return inversa.reshape(S, T), np.column_stack(np.unravel_index(primeros, (S, T)))
+
+
+def quema_por_simulacion(results_dir, rid_idx, n_rodales):
+    """Fracción quemada de cada rodal en cada simulación de Cell2Fire, (K, R).
+
+    Lee una cicatriz a la vez (la última Grids/Grids<k>/ForestGrid*.csv de cada simulación, 1 = quemada)
+    y la reduce por rodal con bincount, así nunca se tienen todas en memoria.
+    """
+    rid_idx = rid_idx.ravel()
+    celdas = np.bincount(rid_idx[rid_idx >= 0], minlength=n_rodales)
+    simulaciones = sorted(Path(results_dir, "Grids").glob("Grids*"), key=lambda p: int(p.name[len("Grids") :]))
+    quemas = np.zeros((len(simulaciones), n_rodales))
+    for k, directorio in enumerate(simulaciones):
+        grillas = sorted(directorio.glob("ForestGrid*.csv"), key=lambda p: int(p.stem[len("ForestGrid") :]))
+        if not grillas:
+            continue  # el incendio no alcanzó a propagarse
+        quemada = np.loadtxt(grillas[-1], delimiter=",").ravel() == 1
+        quemas[k] = np.bincount(rid_idx[quemada & (rid_idx >= 0)], minlength=n_rodales)
+    return quemas / np.maximum(celdas, 1)
+
+
+def simular_quemas(apath, rid_idx, n_rodales, fire_breaks=None, simulaciones=50, semilla=123):
+    """Simula `simulaciones` incendios sobre el raster de combustibles `apath` y retorna la fracción
+    quemada de cada rodal en cada simulación (quema_por_simulacion).
+    """
+    if config_opti["simulador"]["backend"] == "numpy":
+        from fire2a.raster import read_raster
+        from incendios_numpy import fraccion_quemada, simular
 
+        cortafuegos = None if fire_breaks is None else read_raster(str(fire_breaks))[0]
+        cicatrices, _, _ = simular(read_raster(str(apath))[0], simulaciones, semilla, cortafuegos)
+        return fraccion_quemada(cicatrices, rid_idx, n_rodales)
+
+    iniciar_qgis()
     result = processing.run(
         "fire2a:cell2firesimulator",
         {
-            "CbdRaster": None,
-            "CbhRaster": None,
-            "CcfRaster": None,
-            "DryRun": False,
-            "ElevationRaster": None,
-            "EnableCrownFire": False,
-            "FireBreaksRaster": None,
-            "FoliarMoistureContent": 66,
-            "FuelModel": 1,
-            "FuelRaster": path_fuels,
-            "IgnitionMode": 0,
-            "IgnitionPointVectorLayer": None,
-            "IgnitionProbabilityMap": None,
-            "IgnitionRadius": 0,
-            "InstanceDirectory": "TEMPORARY_OUTPUT",
-            "InstanceInProject": False,
-            "LiveAndDeadFuelMoistureContentScenario": 2,
-            "NumberOfSimulations": 50,
-            "OtherCliArgs": "",
-            "OutputOptions": [1, 2, 3, 4],
-            "RandomNumberGeneratorSeed": 123,
-            "ResultsDirectory": "TEMPORARY_OUTPUT",
-            "ResultsInInstance": True,
-            "SetFuelLayerStyle": False,
-            "SimulationThreads": 15,
-            "WeatherDirectory": "",
-            "WeatherFile": ".\\example\\Weather.csv",
-            "WeatherMode": 0,
+            **PARAMETROS_C2F,
+            "FuelRaster": apath,
+            "FireBreaksRaster": fire_breaks,
+            "NumberOfSimulations": simulaciones,
+            "RandomNumberGeneratorSeed": semilla,
         },
     )
+    return quema_por_simulacion(result["ResultsDirectory"], rid_idx, n_rodales)
+
+
+def burn_prob_sol_ic(
+    num_soluciones, formato, filtro, input, prices, corta_fuegos=False, id="fid", paisaje="test\\data_base\\proto.shp"
+):
+    """Como burn_prob_sol, pero simula por lotes y acota el NPV post incendios de cada solución con
+    intervalos bootstrap (post_optimization.bootstrap_npv).
+
+    Cada lote agrega incendios.simulaciones_lote simulaciones a cada paisaje (con otra semilla); se detiene
+    cuando el intervalo de la mejor solución ya no se traslapa con los demás o al llegar a
+    incendios.max_simulaciones. Retorna bp (S, R, T), las quemas por simulación (S, T, K, R) y los
+    intervalos (S, 2). Lanza ValueError antes de simular si falta el archivo de algún paisaje, ya que un
+    paisaje sin simular sesgaría el NPV de su solución y la comparación de intervalos.
+    """
+    incendios = config_opti["incendios"]
+    periodos = config["horizonte"]
+    rids = [rodal["rid"] for rodal in filtro[0].values()]
+    vendible = tensor_filtro(filtro)
+    fire_breaks = r".\\cortafuegos\\cortafuego_2%.tif" if corta_fuegos else None
+    input_path = Path(input)
+
+    paisaje_st, primeros = paisajes_unicos(filtro, num_soluciones)
+    rutas = [input_path / f"fuels_solucion_{s}_periodo_{t}{formato}" for s, t in primeros]
+    faltantes = [str(path_p) for path_p in rutas if not path_p.exists()]
+    if faltantes:
+        raise ValueError(f"no existen los paisajes {faltantes}")
+
+    lotes = []
+    with tempfile.TemporaryDirectory() as temp_dir:
+        rid_idx, _ = grilla_rid(paisaje, rids, temp_dir, id)
+        for lote in range(max(1, incendios["max_simulaciones"] // incendios["simulaciones_lote"])):
+            quemas = np.empty((len(primeros), incendios["simulaciones_lote"], len(rids)))
+            for u, path_p in enumerate(rutas):
+                quemas[u] = simular_quemas(
+                    str(path_p),
+                    rid_idx,
+                    len(rids),
+                    fire_breaks,
+                    incendios["simulaciones_lote"],
+                    incendios["semilla"] + lote,
+                )
+            lotes.append(quemas[paisaje_st])
+
+            quemas = np.concatenate(lotes, axis=2)
+            _, ic = bootstrap_npv(quemas, vendible, prices)
+            print(f"{quemas.shape[2]} simulaciones por paisaje, intervalos NPV: {np.round(ic, 2).tolist()}")
+            if intervalos_separados(ic):
+                break
+
+    bp = quemas.mean(axis=2).transpose(0, 2, 1)
+    bp = np.cumsum(bp, axis=-1) / np.arange(1, periodos + 1)
+    return bp, quemas, ic
+
+
+def simulador_paisajes(rids, corta_fuegos=False, id="fid", paisaje="test\\data_base\\proto.shp"):
+    """Crea la función `simular(paisajes)` que usa tactico.prob_quema.
+
+    Cada paisaje es un vector de códigos Kitral por rodal (en el orden de `rids`); para cada uno se crea
+    el raster de combustibles sobre los polígonos de `paisaje`, se simulan los incendios con burn_prob y se retorna la probabilidad de
+    quema media de cada rodal, (n, R), con NaN si el rodal no aparece en la estadística zonal.
+    """
+    fire_breaks = r".\\cortafuegos\\cortafuego_2%.tif" if corta_fuegos else None
+    grilla = {}
+
+    def simular(paisajes):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            temp_dir_path = Path(temp_dir)
+            if not grilla:
+                # los polígonos que no son rodales mantienen su kitral_cod del paisaje
+                from auxiliary import get_data
+
+                capa = get_data(paisaje)
+                grilla["poligonos"], grilla["info"] = grilla_poligonos(capa, temp_dir)
+                grilla["rodal"] = indice_en(capa[id].to_numpy(), rids)
+                grilla["base"] = capa["kitral_cod"].fillna(-9999).to_numpy(dtype=int)
+                grilla["rid_idx"] = np.append(grilla["rodal"], -1)[grilla["poligonos"]]
+            rutas = []
+            for n, codigos in enumerate(paisajes):
+                rutas.append(str(temp_dir_path / f"fuels_paisaje_{n}.tif"))
+                tabla = tabla_poligonos(grilla["base"], grilla["rodal"], codigos)
+                raster_rodales(tabla, grilla["poligonos"], grilla["info"], rutas[-1])
+            return simular_rasters(rutas, temp_dir_path, fire_breaks, paisaje, id, rids, grilla["rid_idx"])
+
+    return simular
+
+
+def fuels_creation(gdf, filtro, output, id="fid", formato=".tif"):
+    """Crea los combustibles de las soluciones, fuels_solucion_{s}_periodo_{t}{formato} en `output`.
+
+    Los polígonos se rasterizan una sola vez (grilla_poligonos) y cada raster es la tabla de códigos Kitral
+    por polígono indexada por esa grilla: el kitral_cod de `gdf`, salvo en los rodales de `filtro`, que
+    toman el código de la solución y periodo. Con `formato` ".asc" se escribe el ASCII de Cell2Fire.
+    """
+    base_dir = Path(output)
+    rids = [rodal["rid"] for rodal in filtro[0].values()]
+    kitral = np.array([[rodal["codigo_kitral"] for rodal in solucion.values()] for solucion in filtro])  # (S, R, T)
+    rodal = indice_en(gdf[id].to_numpy(), rids)
+    base = gdf["kitral_cod"].fillna(-9999).to_numpy(dtype=int)
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        poligonos, info = grilla_poligonos(gdf, temp_dir)
+
+    for s in range(kitral.shape[0]):  # soluciones
+        for t in range(kitral.shape[2]):  # periodos
+            tabla = tabla_poligonos(base, rodal, kitral[s, :, t])
+            raster_rodales(tabla, poligonos, info, base_dir / f"fuels_solucion_{s}_periodo_{t}{formato}")
+    print("combustibles en carpeta de soluciones")
+
+
+def protection_value(path_fuels, path_biomass):
+    """
+    Calculate the protection value using the specified fuel and biomass rasters.
+
+    With simulador.backend = "numpy" it is incendios_numpy.valor_protegido over the same fires (not scaled)."""
+    from fire2a.raster import read_raster
+
+    if config_opti["simulador"]["backend"] == "numpy":
+        from incendios_numpy import simular, valor_protegido
+
+        combustibles, r_info = read_raster(str(path_fuels))
+        biomasa = np.maximum(np.nan_to_num(read_raster(str(path_biomass))[0]), 0)  # sin nodata
+        _, padre, paso = simular(combustibles)
+        return valor_protegido(padre, paso, biomasa), r_info
+
+    iniciar_qgis()
+    result = processing.run(
+        "fire2a:cell2firesimulator", {**PARAMETROS_C2F, "FuelRaster": path_fuels, "FireBreaksRaster": None}
+    )
     if rd := result.get("ResultsDirectory"):
         pass
     else:
@@ -381,40 +734,23 @@ def protection_value(path_fuels, path_biomass):
 
 def fuels_creation_cortafuegos(gdf, caso_base):
     """Crea los combustibles y biomasa a partir de geopandas y los filtros del caso base (sin ningun manejo)"""
-    gdf_temp = gdf.copy()
-    periodos = config["horizonte"]
     base_dir_biomass = Path("./cortafuegos/biomass")
     base_dir_fuels = Path("./cortafuegos/fuels")
-    gdf_temp["biomass"] = 0
-
-    for t in range(periodos):
-        for r in range(len(caso_base)):  # rodales
-            gdf_temp.loc[gdf_temp["fid"] == caso_base[r]["rid"], "kitral_cod"] = caso_base[r]["codigo_kitral"][t]
-            gdf_temp.loc[gdf_temp["fid"] == caso_base[r]["rid"], "biomass"] = caso_base[r]["biomass"][t]
-        # Directorio base
-
-        temp_dir = tempfile.TemporaryDirectory()
-        # Crear un objeto Path para el archivo temporal .shp
-        shp_path = Path(temp_dir.name) / "temp_file.shp"
-        # Guardar el GeoDataFrame como un shapefile
-        gdf_temp.to_file(shp_path)
-
-        # Nombre del archivo con variables dinámicas
-        file_name_fuels = f"fuels_base_periodo_{t}.tif"
-        file_name_biomass = f"biomass_base_periodo_{t}.tif"
-        # Ruta completa al archivo
-
-        base_path_fuels = base_dir_fuels / file_name_fuels
-        base_path_biomass = base_dir_biomass / file_name_biomass
-
-        # Eliminar el archivo si ya existe para asegurarse de que se reescriba
-        if base_path_biomass.exists():
-            base_path_biomass.unlink()
-        if base_path_fuels.exists():
-            base_path_fuels.unlink()
-
-        fuels_tif(shp_path, "kitral_cod", base_path_fuels)  # se escribe los fuels
-        fuels_tif(shp_path, "biomass", base_path_biomass)  # se escriben los biomass
+    rodales = [caso_base[r] for r in range(len(caso_base))]
+    kitral = np.array([rodal["codigo_kitral"] for rodal in rodales])  # (R, T)
+    biomasa = np.array([rodal["biomass"] for rodal in rodales])
+    # fuera de los rodales: el combustible original del shapefile y biomasa 0
+    rodal = indice_en(gdf["fid"].to_numpy(), [rodal["rid"] for rodal in rodales])
+    base = gdf["kitral_cod"].fillna(-9999).to_numpy(dtype=int)
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        poligonos, info = grilla_poligonos(gdf, temp_dir)
+
+    for t in range(config["horizonte"]):
+        fuels = tabla_poligonos(base, rodal, kitral[:, t])
+        biomass = tabla_poligonos(np.zeros(len(gdf)), rodal, biomasa[:, t])
+        raster_rodales(fuels, poligonos, info, base_dir_fuels / f"fuels_base_periodo_{t}.tif")
+        raster_rodales(biomass, poligonos, info, base_dir_biomass / f"biomass_base_periodo_{t}.tif")
     print("combustibles en  carpeta cortafuegos/fuels y biomasa en carpeta de cortafuegos/biomass")
 
 